@@ -4,12 +4,28 @@ Replay Mix+ by soreikomori
 https://github.com/soreikomori/ReplayMixPlus
 """
 version = "1.6.3"
-import pkg_resources
+import time
+startTime = time.perf_counter()
 import subprocess
 import sys
 import argparse
+import random
+import signal
+import threading
 import logging_setup
 import logging
+import dependency_check
+import json_tools as jt
+import profile_runner
+
+# Time from launch until the engines are imported and the first API call can be made, in seconds.
+# A warning is logged when startup takes longer than this.
+startupBudget = 2.0
+# Default intervals of the daemon mode, in seconds. They can be changed with "daemon_playlist_interval",
+# "daemon_compendium_interval" and "daemon_jitter" (a fraction of the interval) in config.json.
+defaultPlaylistInterval = 60 * 60
+defaultCompendiumInterval = 24 * 60 * 60
+defaultJitter = 0.1
 
 # DEPENDENCY CHECK
 def checkDependencies(logger):
@@ -22,20 +38,74 @@ def checkDependencies(logger):
     logger : logging.Logger
         The logger object.
     """
-    valid = True
-    with open("requirements.txt", 'r') as file:
-        requirements = pkg_resources.parse_requirements(file)
-        for requirement in requirements:
-            try:
-                pkg_resources.require(str(requirement))
-            except pkg_resources.DistributionNotFound:
-                valid = False  # A dependency is missing
-            except pkg_resources.VersionConflict:
-                valid = False  # Version conflict exists
-    if not valid:
+    if not dependency_check.checkDependencies("requirements.txt"):
         logger.error("One or more dependencies are missing. Installing...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
 
+def nextRunIn(interval, jitter):
+    """
+    Picks the delay until the next run of a job, spreading it by a random jitter so runs don't always hit the APIs at the same time.
+
+    Parameters
+    ----------
+    interval : float
+        The interval of the job, in seconds.
+    jitter : float
+        The jitter, as a fraction of the interval.
+
+    Returns
+    -------
+    float
+        The delay in seconds.
+    """
+    return max(0.0, interval * (1 + random.uniform(-jitter, jitter)))
+
+def runDaemon(logger, compendium, playlist):
+    """
+    Keeps running, updating the compendium and/or the playlist on their intervals until SIGTERM or SIGINT is received.
+    Everything runs in this thread, so runs never overlap. The compendium, its title lookup and artist index, and the last.fm
+    and YTM clients stay in memory between runs, and the scrobbles are kept in the daily rollups of scrobbles.db, so each run
+    only loads what changed.
+    A failed run is logged and retried on the next interval. On shutdown, the run in progress is finished first.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger object.
+    compendium : bool
+        Whether to update the compendium.
+    playlist : bool
+        Whether to update the playlist.
+    """
+    stopEvent = threading.Event()
+    def requestStop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping after the current run...")
+        stopEvent.set()
+    signal.signal(signal.SIGTERM, requestStop)
+    signal.signal(signal.SIGINT, requestStop)
+    jitter = jt.loadConfigValue("daemon_jitter", defaultJitter)
+    intervals = {}
+    if compendium:
+        intervals["compendium"] = jt.loadConfigValue("daemon_compendium_interval", defaultCompendiumInterval)
+    if playlist:
+        intervals["playlist"] = jt.loadConfigValue("daemon_playlist_interval", defaultPlaylistInterval)
+    logger.info("Daemon started. Intervals: " + ", ".join(f"{job} every {interval} s" for job, interval in intervals.items()))
+    # Both jobs are due right away. When both are due, the compendium is updated first so the playlist can use the new tracks.
+    nextRuns = {job: time.monotonic() for job in intervals}
+    while not stopEvent.is_set():
+        now = time.monotonic()
+        due = [job for job in intervals if nextRuns[job] <= now]
+        if len(due) == 0:
+            stopEvent.wait(min(nextRuns.values()) - now)
+            continue
+        try:
+            profile_runner.runUpdates("compendium" in due, "playlist" in due)
+        except Exception:
+            logger.exception("Update failed, it will be retried on the next interval.")
+        for job in due:
+            nextRuns[job] = time.monotonic() + nextRunIn(intervals[job], jitter)
+    logger.info("Daemon stopped.")
+
 def initialize():
     """
     Automated initialization for ReplayMix+. Checks command line arguments and runs the appropriate function.
@@ -44,7 +114,12 @@ def initialize():
     parser = argparse.ArgumentParser(description="Automated Console for ReplayMix+")
     parser.add_argument("-p", "--playlist", action="store_true", help="Updates the ReplayMix+ Playlist.")
     parser.add_argument("-c", "--compendium", action="store_true", help="Updates the Compendium.")
+    parser.add_argument("-f", "--full", action="store_true", help="With -c or -b, fetches every playlist into the Compendium again, not only the ones that changed.")
     parser.add_argument("-vb", "--verbose", action="store_true", help="Enables verbose logging.")
+    parser.add_argument("-d", "--daemon", action="store_true", help="Keeps running and updates the Playlist and/or Compendium on the intervals set in config.json. Updates both if neither -p nor -c is given.")
+    parser.add_argument("-b", "--batch", metavar="PROFILES", help="Runs the updates of every profile in a profiles .json file in parallel. Runs both if neither -p nor -c is given.")
+    parser.add_argument("-w", "--workers", type=int, help="Amount of worker processes for --batch.")
+    parser.add_argument("-r", "--report", default=profile_runner.defaultReportFile, help="Report file of --batch.")
     args = parser.parse_args()
     # Logging Setup
     # Change the False to True if you want verbose debug logging.
@@ -57,15 +132,28 @@ def initialize():
     logger.info(f" - - - ReplayMix+ Automated Console {version} - - - ")
     logger.info("Checking dependencies...")
     checkDependencies(logger)
-    import generator_engine as gE
-    import compendium_engine as cE
+    # The engines are only used through profile_runner. They're imported here so a broken dependency fails right after the
+    # check, and so their import time counts against startupBudget.
+    import generator_engine  # noqa: F401
+    import compendium_engine  # noqa: F401
     logger.info("Dependencies are installed.")
-    if args.compendium:
-        logger.info("Updating Compendium...")
-        cE.loadAllPlaylists()
-    if args.playlist:
-        logger.info("Updating Playlist...")
-        gE.recreatePlaylist()
+    startupTime = time.perf_counter() - startTime
+    logger.info(f"Startup took {startupTime * 1000:.0f} ms.")
+    if startupTime > startupBudget:
+        logger.warning(f"Startup took longer than the {startupBudget * 1000:.0f} ms budget.")
+    both = not args.compendium and not args.playlist
+    if args.batch:
+        summaries = profile_runner.runBatch(args.batch, args.compendium or both, args.playlist or both, verbose, args.workers, args.report, args.full)
+        failed = [summary["name"] for summary in summaries if not summary["succeeded"]]
+        logger.info(f"Batch finished. {len(summaries) - len(failed)} of {len(summaries)} profiles succeeded.")
+        if failed:
+            sys.exit(1)
+    elif args.daemon:
+        runDaemon(logger, args.compendium or both, args.playlist or both)
+    else:
+        profile_runner.runUpdates(args.compendium, args.playlist, args.full)
     logger.info("Exiting...")
-    
-initialize()
\ No newline at end of file
+
+# Worker processes of --batch may import this file again, so only the main process initializes.
+if __name__ == "__main__":
+    initialize()
\ No newline at end of file
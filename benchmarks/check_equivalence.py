@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+
+Checks that the optimized code paths still give the same results as their reference implementations, on synthetic data
+and without touching the network. Run it after changing any of them; it fails if any check finds a difference.
+Usage: python benchmarks/check_equivalence.py [--checks scores ...] [--seed 0]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import logging
+import random
+import tempfile
+import time
+from unittest import mock
+from rapidfuzz import fuzz
+import compendium_engine as cE
+import compendium_store as cs
+import generator_engine as gE
+import json_tools as jt
+import metrics
+import scrobble_store as ss
+import synthetic
+import ytm_client as ytm
+from standins import FakeLastFmApi, FakeLastFmUser, FakeYTMusic
+
+def checkScores(args):
+    """
+    Checks calcScores against calcScore, track by track, and selectTopScores against a full stable sort, with random
+    weights, windows, missing last plays and tied scores.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if every score and selection is the same.
+    """
+    rng = random.Random(args.seed)
+    # A whole second, as calcScore truncates lastPlayed.
+    now = int(time.time())
+    mismatches = 0
+    for _ in range(args.cases):
+        count = rng.randint(1, 300)
+        windowSeconds = rng.choice([7, 30, 365]) * 24 * 60 * 60
+        weights = {name: rng.choice([0, 0.5, 0.7, 1, 2]) for name in gE.defaultScoreWeights}
+        scrobbles = [rng.randint(1, 50) for _ in range(count)]
+        lastPlayed = [None if rng.random() < 0.1 else int(now - rng.uniform(0, windowSeconds)) for _ in range(count)]
+        repetitions = [rng.randint(1, 10) for _ in range(count)]
+        with mock.patch("time.time", return_value=now):
+            scores = gE.calcScores(scrobbles, lastPlayed, repetitions, max(scrobbles), max(repetitions), weights, windowSeconds)
+            expected = [gE.calcScore(scrobbles[i], now - windowSeconds if lastPlayed[i] is None else lastPlayed[i], repetitions[i],
+                                     max(scrobbles), max(repetitions), weights, windowSeconds) for i in range(count)]
+        if any(abs(score - expectedScore) > 1e-9 for score, expectedScore in zip(scores, expected)):
+            mismatches += 1
+            continue
+        # Rounding makes plenty of ties, which have to keep their original order.
+        scores = scores.round(1)
+        size = rng.choice([0, 1, count // 2, count, count + 10])
+        expectedOrder = sorted(range(count), key=lambda i: -scores[i])[:size]
+        if gE.selectTopScores(scores, size).tolist() != expectedOrder:
+            mismatches += 1
+    print(f"{'scores':<16} {args.cases} cases, {mismatches} mismatched")
+    return mismatches == 0
+
+def longestIncreasingRun(sequence):
+    """
+    Finds the length of the longest increasing subsequence the slow way, as the reference for planPlaylistMoves.
+
+    Parameters
+    ----------
+    sequence : list
+        The numbers.
+
+    Returns
+    -------
+    int
+        The length of the subsequence.
+    """
+    lengths = []
+    for i, value in enumerate(sequence):
+        lengths.append(1 + max([lengths[j] for j in range(i) if sequence[j] < value], default=0))
+    return max(lengths, default=0)
+
+def checkPlaylistSync(args):
+    """
+    Checks that the moves of planPlaylistMoves turn the current order into the target one with the fewest moves possible,
+    and that syncPlaylist leaves a playlist with exactly the target tracks in order (minus the ones YTM refuses), starting
+    from random playlists with stale tracks and duplicates. Playlists only wait when add requests fail, and fail the sync
+    with RuntimeError if every attempt fails.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if every playlist ends up as expected.
+    """
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for _ in range(args.cases):
+        targetIds = [f"v{i}" for i in rng.sample(range(200), rng.randint(0, 60))]
+        currentIds = rng.sample(targetIds, len(targetIds))
+        playlist = list(currentIds)
+        moves = gE.planPlaylistMoves(currentIds, targetIds)
+        for videoId, successorId in moves:
+            playlist.remove(videoId)
+            playlist.insert(len(playlist) if successorId is None else playlist.index(successorId), videoId)
+        targetPositions = {videoId: position for position, videoId in enumerate(targetIds)}
+        if playlist != targetIds or len(moves) != len(targetIds) - longestIncreasingRun([targetPositions[videoId] for videoId in currentIds]):
+            mismatches += 1
+            continue
+        existing = rng.sample(targetIds, rng.randint(0, len(targetIds))) + [f"v{i}" for i in rng.sample(range(200, 300), rng.randint(0, 10))]
+        existing += rng.sample(existing, min(len(existing), rng.randint(0, 3)))
+        rng.shuffle(existing)
+        unavailableIds = set(rng.sample(targetIds, min(len(targetIds), rng.randint(0, 2))))
+        failedAdds = rng.choice([0, 0, 0, 1, 2, 3])
+        fakeYt = FakeYTMusic([("PLcheck", "ReplayMix+", [])], [], unavailableIds, failedAdds)
+        for videoId in existing:
+            fakeYt.playlists["PLcheck"]["tracks"].append({"videoId": videoId, "title": videoId, "artists": [], "setVideoId": f"SV{next(fakeYt.setVideoIds)}"})
+        ytm.client = fakeYt
+        expectedIds = [videoId for videoId in targetIds if videoId not in unavailableIds or videoId in existing]
+        # Every attempt only fails if there is something to add.
+        failing = failedAdds == 3 and any(videoId not in existing for videoId in targetIds)
+        with mock.patch("time.sleep") as sleep:
+            try:
+                gE.syncPlaylist("PLcheck", targetIds)
+                failed = False
+            except RuntimeError:
+                failed = True
+        if failed != failing or sleep.called != (fakeYt.failedAdds < failedAdds) or (
+                not failing and [track["videoId"] for track in fakeYt.playlists["PLcheck"]["tracks"]] != expectedIds):
+            mismatches += 1
+    ytm.client = None
+    print(f"{'playlist sync':<16} {args.cases} cases, {mismatches} mismatched")
+    return mismatches == 0
+
+def checkMatchCache(args):
+    """
+    Checks cachedBatchCheckYTMIds against batchCheckYTMIds while the compendium store grows by appends, so cached hits and
+    misses have to be invalidated by the tracks appended after them.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if every cached result is the same as matching again.
+    """
+    rng = random.Random(args.seed)
+    rawCompendium = synthetic.makeCompendium(args.tracks, args.seed)
+    tracks = cE.toTracks(rawCompendium)
+    # Top tracks come from the whole library, so many of them are only found once their track is appended.
+    fmTracks = [(title, artist) for title, artist, _ in synthetic.makeTopTracks(rawCompendium, 300, seed=args.seed)]
+    # Artists scrobbled with other casing or spacing share the cache entries of the original ones.
+    fmTracks += [(title, rng.choice([artist.upper(), artist.swapcase(), " " + "  ".join(artist.split())])) for title, artist in fmTracks[:100]]
+    mismatches = 0
+    steps = 0
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        jt.writeIntoJson({}, jt.configFile)
+        stored = len(tracks) * 2 // 5
+        cs.replaceTracks(tracks[:stored])
+        metrics.reset()
+        while True:
+            queries = rng.sample(fmTracks, 250)
+            compendium, titleLookup, artistIndex = cE.loadCachedCompendium()
+            if gE.cachedBatchCheckYTMIds(queries, compendium, titleLookup, artistIndex) != gE.batchCheckYTMIds(queries, compendium, titleLookup, artistIndex):
+                mismatches += 1
+            steps += 1
+            if stored == len(tracks):
+                break
+            appended = tracks[stored:stored + rng.randint(1, len(tracks) // 8)]
+            cs.appendTracks(appended)
+            stored += len(appended)
+        hits = sum(counter["value"] for counter in metrics.snapshot()["counters"]
+                   if counter["name"] == "cache_hits" and counter["labels"] == {"cache": "matches"})
+        os.chdir(os.path.dirname(workDir))
+    print(f"{'match cache':<16} {steps} runs between appends, {hits} cache hits, {mismatches} mismatched")
+    return mismatches == 0
+
+def makeLoopingHistory(rng, start, end):
+    """
+    Creates a scrobble history with loops of up to 8 plays and gaps from a minute to several hours, so loops cross midnight.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random generator.
+    start : int
+        The unix timestamp of the first scrobble.
+    end : int
+        The unix timestamp the history ends at.
+
+    Returns
+    -------
+    list
+        A list of (timestamp, title, artist) tuples, newest first.
+    """
+    history = []
+    timestamp = start
+    while timestamp < end:
+        number = rng.randrange(40)
+        for _ in range(rng.choice([1, 1, 1, 2, 3, 8])):
+            history.append((timestamp, f"Track {number}", f"Artist {number}"))
+            timestamp += rng.choice([60, 200, 3600, 20000])
+            if timestamp >= end:
+                break
+    return history[::-1]
+
+def checkScrobbleRollups(args):
+    """
+    Checks the statistics syncScrobbleStats merges from the daily rollups of scrobbles.db against buildScrobbleStats over
+    the raw scrobbles of the same window, while the history grows and the window changes between 3 and 60 days.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if the statistics are the same after every sync.
+    """
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    start = now - 80 * 24 * 60 * 60
+    history = makeLoopingHistory(rng, start, now - 100)
+    user = FakeLastFmUser([], history)
+    windows = [7] * 10 + [30] * 6 + [3] * 5 + [60] * 5 + [7] * 10
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as workDir, FakeLastFmApi([]) as fakeApi:
+        os.chdir(workDir)
+        jt.writeIntoJson({"lastfm_api_url": fakeApi.url}, jt.configFile)
+        cut = start + 20 * 24 * 60 * 60
+        for windowDays in windows:
+            cut = min(now, cut + rng.randint(3600, 3 * 24 * 60 * 60))
+            fakeApi.history = user.history = [scrobble for scrobble in history if scrobble[0] <= cut]
+            since = cut - windowDays * 24 * 60 * 60
+            stats = ss.syncScrobbleStats(user, since)
+            expected = gE.buildScrobbleStats(user.get_recent_tracks(limit=None, time_from=ss.dayOf(since) * ss.daySeconds))
+            expected = {title: dict(entry, lastPlayed=int(entry["lastPlayed"])) for title, entry in expected.items()}
+            mismatches += stats != expected
+        os.chdir(os.path.dirname(workDir))
+    print(f"{'scrobble rollups':<16} {len(windows)} syncs of {len(history)} scrobbles, {mismatches} mismatched")
+    return mismatches == 0
+
+def fullScanYTMId(givenTitle, artistParam, compendium, titleLookup):
+    """
+    Finds the YTM ID of a last.fm track by scoring the title against every track of the compendium, as checkYTMId did
+    before the artist index. The reference for checkYTMId and batchCheckYTMIds.
+
+    Parameters
+    ----------
+    givenTitle : str
+        The title of the track.
+    artistParam : str
+        The artist of the track.
+    compendium : list
+        A compendium (list of Track records).
+    titleLookup : dict
+        The title lookup created by compendium_engine.buildTitleLookup for the compendium.
+
+    Returns
+    -------
+    str or None
+        The videoId of the track in the compendium. None if the track is not found.
+    """
+    givenTitleLower = givenTitle.lower()
+    artistParam = gE.normalizeArtistParam(artistParam)
+    artistParamSplitted = gE.splitArtistParam(artistParam)
+    for track in titleLookup.get(givenTitleLower, []):
+        if gE.artistMatches(track, artistParam, artistParamSplitted):
+            return track.videoId
+    for track in compendium:
+        for title in track.titleVariants:
+            if fuzz.ratio(title, givenTitleLower) > gE.titleSimThreshold:
+                if gE.artistMatches(track, artistParam, artistParamSplitted):
+                    return track.videoId
+                break
+    return None
+
+def checkArtistIndex(args):
+    """
+    Checks checkYTMId and batchCheckYTMIds, which only score the tracks of the artist found with the artist index, against
+    the full scan of the compendium, with upper case, truncated, joined differently and empty artists. Also checks that
+    the artist index extended with indexArtists is the same as building it again.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if every YTM ID and the extended index are the same.
+    """
+    rawCompendium = synthetic.makeCompendium(args.tracks, args.seed)
+    compendium = cE.toTracks(rawCompendium)
+    titleLookup = cE.buildTitleLookup(compendium)
+    artistIndex = cE.buildArtistIndex(compendium)
+    topTracks = [(title, artist) for title, artist, _ in synthetic.makeTopTracks(rawCompendium, 300, seed=args.seed)]
+    queries = (topTracks + [(title, artist.upper()) for title, artist in topTracks[:50]]
+               + [(title, artist[:-1]) for title, artist in topTracks[50:100]]
+               + [(title, artist.replace(" & ", ", ")) for title, artist in topTracks[100:150]]
+               + [(title, "") for title, _ in topTracks[150:170]])
+    expected = [fullScanYTMId(title, artist, compendium, titleLookup) for title, artist in queries]
+    single = [gE.checkYTMId(title, artist, compendium, titleLookup, artistIndex) for title, artist in queries]
+    batch = gE.batchCheckYTMIds(queries, compendium, titleLookup, artistIndex)
+    mismatches = sum(a != b for a, b in zip(single, expected)) + sum(a != b for a, b in zip(batch, expected))
+    half = len(compendium) // 2
+    extendedIndex = cE.buildArtistIndex(compendium[:half])
+    cE.indexArtists(compendium[half:], half, extendedIndex)
+    mismatches += extendedIndex != artistIndex
+    print(f"{'artist index':<16} {len(queries)} queries ({sum(videoId is not None for videoId in expected)} found), {mismatches} mismatched")
+    return mismatches == 0
+
+def referenceMasterList(topTracks, user, compendium, windowStart, now, playlistSize):
+    """
+    Creates the master list with the reference implementations: batchCheckYTMIds, buildScrobbleStats over the raw
+    scrobbles, calcScore for every track and a full stable sort.
+
+    Parameters
+    ----------
+    topTracks : list
+        The (title, artist, scrobbles) top tracks.
+    user : FakeLastFmUser
+        The user with the scrobble history.
+    compendium : list
+        A compendium (list of Track records).
+    windowStart : int
+        The unix timestamp where the scoring window starts.
+    now : int
+        The unix timestamp the window ends at.
+    playlistSize : int
+        The amount of tracks in the master list.
+
+    Returns
+    -------
+    list
+        The (title, ytmid) tuples of the master list, in order.
+    """
+    scrobbleStats = gE.buildScrobbleStats(user.get_recent_tracks(limit=None, time_from=windowStart))
+    ytmIds = gE.batchCheckYTMIds([(title, artist) for title, artist, _ in topTracks], compendium)
+    candidates = []
+    for (title, _, scrobbles), ytmId in zip(topTracks, ytmIds):
+        if ytmId is not None and ytmId not in [candidate[1] for candidate in candidates]:
+            candidates.append((title, ytmId, scrobbles))
+    maxRepetitions = max((stats["maxRepetitions"] for stats in scrobbleStats.values()), default=0)
+    scores = []
+    for title, _, scrobbles in candidates:
+        lastPlayed = gE.lastPlayedChecker(title, scrobbleStats)
+        scores.append(gE.calcScore(scrobbles, windowStart if lastPlayed is None else lastPlayed, gE.repetitionChecker(title, scrobbleStats),
+                                   topTracks[0][2], maxRepetitions, gE.loadScoreWeights(), now - windowStart))
+    order = sorted(range(len(candidates)), key=lambda i: -scores[i])[:playlistSize]
+    return [candidates[i][:2] for i in order]
+
+def checkMasterList(args):
+    """
+    Checks createMasterList against referenceMasterList, with scoring windows shorter than the top tracks period, one of
+    them without any scrobble.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if every master list is the same.
+    """
+    now = int(time.time())
+    rawCompendium = synthetic.makeCompendium(args.tracks, args.seed)
+    topTracks = synthetic.makeTopTracks(rawCompendium, 200, seed=args.seed)
+    # The scrobbles end before yesterday, so a 1 day window has none of them.
+    history = synthetic.makeScrobbleHistory(topTracks, 2000, ss.dayOf(now) * ss.daySeconds - 2 * 24 * 60 * 60, seed=args.seed)
+    user = FakeLastFmUser(topTracks, history)
+    mismatches = 0
+    connect = gE.lastFmNetworkConnect
+    gE.lastFmNetworkConnect = lambda: user
+    gE.lastFmUser = None
+    with tempfile.TemporaryDirectory() as workDir, FakeLastFmApi(history) as fakeApi:
+        os.chdir(workDir)
+        cs.replaceTracks(cE.toTracks(rawCompendium))
+        for windowDays in (1, 7):
+            jt.writeIntoJson({"top_tracks_period": "1month", "scoring_window_days": windowDays, "playlist_size": 50,
+                              "lastfm_api_url": fakeApi.url}, jt.configFile)
+            windowStart = ss.dayOf(now - windowDays * 24 * 60 * 60) * ss.daySeconds
+            with mock.patch("time.time", return_value=now):
+                masterList = [(track["title"], track["ytmid"]) for track in gE.createMasterList()]
+                mismatches += masterList != referenceMasterList(topTracks, user, cE.loadCompendium(), windowStart, now, 50)
+        os.chdir(os.path.dirname(workDir))
+    gE.lastFmNetworkConnect = connect
+    gE.lastFmUser = None
+    print(f"{'master list':<16} 2 windows (1 of them empty), {mismatches} mismatched")
+    return mismatches == 0
+
+checks = {
+    "scores": checkScores,
+    "playlist": checkPlaylistSync,
+    "matches": checkMatchCache,
+    "rollups": checkScrobbleRollups,
+    "artists": checkArtistIndex,
+    "masterlist": checkMasterList,
+}
+
+def initialize():
+    """
+    Parses the command line arguments and runs the checks.
+    """
+    parser = argparse.ArgumentParser(description="Equivalence checks for ReplayMix+")
+    parser.add_argument("--checks", nargs="+", choices=list(checks), default=list(checks), help="Checks to run. All of them by default.")
+    parser.add_argument("--cases", type=int, default=200, help="Amount of random cases of the checks that use them.")
+    parser.add_argument("--tracks", type=int, default=5000, help="Amount of tracks in the synthetic compendium of the checks that use one.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    args = parser.parse_args()
+    logger = logging.getLogger('rpmplusLogger')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    if not all([checks[name](args) for name in args.checks]):
+        sys.exit("Some optimized paths don't match their reference implementations.")
+
+initialize()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+
+Measures what logging costs in the hot paths, without touching the network:
+- the wall time of purgeFetchedPlaylist, removeDuplicates and checkYTMId with debug logging off, which is only spent on
+  their log calls when those build their messages before knowing if they're emitted;
+- the time the calling thread spends per record written into rpmplus.log, with the handlers set up by logging_setup.
+Run it before and after a change to the logging to compare.
+Usage: python benchmarks/logging_overhead.py [--tracks 20000] [--records 20000]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import logging
+import tempfile
+import time
+import json_tools as jt
+import compendium_engine as cE
+import generator_engine as gE
+import logging_setup
+import synthetic
+
+def bestOf(function, repeats):
+    """
+    Runs a function several times and returns the fastest wall time, which is the least disturbed by noise.
+
+    Parameters
+    ----------
+    function : function
+        The function, with no arguments.
+    repeats : int
+        The amount of runs.
+
+    Returns
+    -------
+    float
+        The fastest wall time in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def measureHotPaths(args, logger):
+    """
+    Prints the wall time of the hot paths with debug logging off.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    logger : logging.Logger
+        The rpmplusLogger.
+    """
+    compendium = synthetic.makeCompendium(args.tracks, args.seed)
+    rawPlaylist = [{"videoId": track["videoId"], "title": track["title"], "artists": track["artists"]} for track in compendium]
+    purged = cE.purgeFetchedPlaylist(rawPlaylist)
+    titleLookup = cE.buildTitleLookup(purged)
+    artistIndex = cE.buildArtistIndex(purged)
+    queries = [(title, artist) for title, artist, _ in synthetic.makeTopTracks(compendium, 20, seed=args.seed)]
+    stages = {
+        "purgeFetchedPlaylist": lambda: cE.purgeFetchedPlaylist(rawPlaylist),
+        "removeDuplicates": lambda: cE.removeDuplicates(purged, []),
+        "checkYTMId": lambda: [gE.checkYTMId(title, artist, purged, titleLookup, artistIndex) for title, artist in queries],
+    }
+    logger.setLevel(logging.INFO)
+    for name, stage in stages.items():
+        print(f"{name:<24} {bestOf(stage, args.repeats):>10.3f} s (debug off)")
+
+def measureEmit(args, logger):
+    """
+    Prints the time the calling thread spends per record written into the log file.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    logger : logging.Logger
+        The rpmplusLogger.
+    """
+    logging_setup.setup_logger(False)
+    start = time.perf_counter()
+    for i in range(args.records):
+        logger.info("Benchmark record %d of %d", i, args.records)
+    elapsed = time.perf_counter() - start
+    print(f"{'emit (calling thread)':<24} {elapsed / args.records * 1e6:>10.2f} us per record")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    stop = getattr(logging_setup, "stop_logger", None)
+    if stop is not None:
+        stop()
+
+def initialize():
+    """
+    Parses the command line arguments and runs the measurements.
+    """
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark for ReplayMix+")
+    parser.add_argument("--tracks", type=int, default=20000, help="Amount of tracks in the hot path measurements.")
+    parser.add_argument("--records", type=int, default=20000, help="Amount of records written in the emit measurement.")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs of every measurement. The fastest one is kept.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    args = parser.parse_args()
+    logger = logging.getLogger('rpmplusLogger')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        jt.writeIntoJson({"avoid_different_version_duplicates": True}, "config.json")
+        measureHotPaths(args, logger)
+        measureEmit(args, logger)
+        os.chdir(os.path.dirname(workDir))
+
+initialize()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+
+Offline benchmarks for the matching, dedupe and scoring hot paths.
+Runs every stage against synthetic libraries of different sizes, with local stand-ins for YTM and last.fm, and saves the results as json.
+Usage: python benchmarks/run_benchmarks.py [--sizes 1000 10000] [--output results.json] [--compare previous.json]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import json_tools as jt
+import compendium_engine as cE
+import generator_engine as gE
+import ytm_client as ytm
+import lastfm_client
+import scrobble_store as ss
+import metrics
+import synthetic
+from standins import FakeYTMusic, FakeLastFmUser, FakeLastFmApi
+
+def runStage(results, size, name, function, apiCounters=()):
+    """
+    Runs a single stage, measuring its wall time, peak memory and API calls, and adds the result to results together with
+    the counters the stage recorded in metrics (fuzzy comparisons, cache hits...).
+
+    Parameters
+    ----------
+    results : list
+        The list of results.
+    size : int
+        The compendium size of this run.
+    name : str
+        The stage name.
+    function : function
+        The stage itself, with no arguments.
+    apiCounters : tuple, optional
+        The apiCalls counters of the stand-ins used by the stage.
+
+    Returns
+    -------
+    any
+        The return value of the stage.
+    """
+    metrics.reset()
+    apiBefore = [counter.copy() for counter in apiCounters]
+    tracemalloc.reset_peak()
+    memoryBefore = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    value = function()
+    wallTime = time.perf_counter() - start
+    peakMemory = tracemalloc.get_traced_memory()[1] - memoryBefore
+    apiCalls = {}
+    for counter, before in zip(apiCounters, apiBefore):
+        for call, count in (counter - before).items():
+            apiCalls[call] = apiCalls.get(call, 0) + count
+    counters = metrics.snapshot()["counters"]
+    fuzzyComparisons = sum(counter["value"] for counter in counters if counter["name"] == "fuzzy_comparisons")
+    result = {"size": size, "stage": name, "wallTime": wallTime, "peakMemory": peakMemory,
+              "fuzzyComparisons": fuzzyComparisons, "apiCalls": apiCalls, "counters": counters}
+    results.append(result)
+    print(f"{size:>8} {name:<22} {wallTime:>10.3f} s {peakMemory / 2**20:>10.1f} MiB {fuzzyComparisons:>14} comparisons")
+    return value
+
+def benchmarkSize(size, args, results):
+    """
+    Runs every stage for a compendium of a given size, inside a temporary working directory.
+
+    Parameters
+    ----------
+    size : int
+        The compendium size.
+    args : argparse.Namespace
+        The command line arguments.
+    results : list
+        The list of results.
+    """
+    now = int(time.time())
+    compendium = synthetic.makeCompendium(size, args.seed)
+    playlists = synthetic.makePlaylists(compendium, max(1, size // 300), args.seed)
+    topTracks = synthetic.makeTopTracks(compendium, args.top_tracks, seed=args.seed)
+    history = synthetic.makeScrobbleHistory(topTracks, args.scrobbles, now, seed=args.seed)
+    fakeYt = FakeYTMusic(playlists, compendium[:200])
+    fakeUser = FakeLastFmUser(topTracks, history)
+    ytm.client = fakeYt
+    gE.lastFmNetworkConnect = lambda: fakeUser
+    gE.lastFmUser = None
+    with FakeLastFmApi(history, args.lastfm_latency) as fakeApi:
+        jt.writeIntoJson({"ytPlaylistId": "PLbenchmark", "debug_logging": False, "avoid_different_version_duplicates": True,
+                          "lastfm_api_url": fakeApi.url}, "config.json")
+        purged = runStage(results, size, "purgeFetchedPlaylist",
+                          lambda: [cE.purgeFetchedPlaylist(tracks) for _, _, tracks in playlists])
+        def dedupe():
+            built = []
+            index = cE.buildCompendiumIndex(built)
+            for playlist in purged:
+                cE.removeDuplicates(playlist, built, index)
+            return built
+        runStage(results, size, "removeDuplicates", dedupe)
+        runStage(results, size, "loadAllPlaylists", lambda: cE.loadAllPlaylists(True), (fakeYt.apiCalls,))
+        stored = runStage(results, size, "loadCompendium", cE.loadCompendium)
+        titleLookup = cE.buildTitleLookup(stored)
+        artistIndex = cE.buildArtistIndex(stored)
+        fmTracks = [(title, artist) for title, artist, _ in topTracks]
+        runStage(results, size, "checkYTMId", lambda: [gE.checkYTMId(title, artist, stored, titleLookup, artistIndex)
+                                                        for title, artist in fmTracks[:args.single_queries]])
+        runStage(results, size, "batchCheckYTMIds", lambda: gE.batchCheckYTMIds(fmTracks, stored, titleLookup, artistIndex))
+        recentTracks = runStage(results, size, "fetchRecentTracks", lambda: lastfm_client.fetchRecentTracks(fakeUser, now - 7 * 24 * 60 * 60),
+                                (fakeApi.apiCalls,))
+        runStage(results, size, "buildScrobbleStats", lambda: gE.buildScrobbleStats(recentTracks))
+        runStage(results, size, "syncScrobbleStats", lambda: ss.syncScrobbleStats(fakeUser, now - 7 * 24 * 60 * 60), (fakeApi.apiCalls,))
+        runStage(results, size, "createMasterList", gE.createMasterList, (fakeUser.apiCalls, fakeApi.apiCalls))
+        runStage(results, size, "recreatePlaylist", gE.recreatePlaylist, (fakeYt.apiCalls, fakeUser.apiCalls, fakeApi.apiCalls))
+
+def gitRevision():
+    """
+    Finds the git revision of the benchmarked code.
+
+    Returns
+    -------
+    str or None
+        The commit hash. None if it isn't a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compareResults(results, previousFile):
+    """
+    Prints the wall time of every stage next to the one in a previous results file.
+
+    Parameters
+    ----------
+    results : list
+        The list of results of this run.
+    previousFile : str
+        A results file saved by a previous run.
+    """
+    with open(previousFile, 'r') as file:
+        previous = {(result["size"], result["stage"]): result for result in json.load(file)["results"]}
+    print("")
+    print(f"Compared with {previousFile}:")
+    for result in results:
+        old = previous.get((result["size"], result["stage"]))
+        if old is not None and old["wallTime"] > 0:
+            print(f"{result['size']:>8} {result['stage']:<22} {old['wallTime']:>10.3f} s -> {result['wallTime']:>10.3f} s "
+                  f"({result['wallTime'] / old['wallTime']:.2f}x)")
+
+def initialize():
+    """
+    Parses the command line arguments and runs the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks for ReplayMix+")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 500000], help="Compendium sizes to benchmark.")
+    parser.add_argument("--top-tracks", type=int, default=200, help="Amount of last.fm top tracks.")
+    parser.add_argument("--scrobbles", type=int, default=5000, help="Amount of scrobbles in the last 7 days.")
+    parser.add_argument("--lastfm-latency", type=float, default=0.05, help="Seconds the last.fm API stand-in takes to answer each request.")
+    parser.add_argument("--single-queries", type=int, default=5, help="Amount of top tracks looked up one by one with checkYTMId.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    parser.add_argument("--output", default="benchmark_results.json", help="File the results are saved into.")
+    parser.add_argument("--compare", help="Results file of a previous run to compare with.")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+    logger = logging.getLogger('rpmplusLogger')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    results = []
+    tracemalloc.start()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workDir:
+            os.chdir(workDir)
+            benchmarkSize(size, args, results)
+            os.chdir(os.path.dirname(args.output))
+    jt.writeIntoJson({"createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": gitRevision(), "python": platform.python_version(),
+                      "arguments": vars(args), "results": results}, args.output)
+    print(f"Results saved into {args.output}")
+    if args.compare:
+        compareResults(results, args.compare)
+
+initialize()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import itertools
+import json
+import threading
+import time
+import pylast
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeYTMusic:
+    """
+    Local stand-in for the YTMusic client, serving a synthetic library without any network access.
+    Playlist edits are applied in memory, and every call is counted in apiCalls. The videoIds in unavailableIds are refused
+    by add_playlist_items, like unavailable or region locked videos are, and its first failedAdds calls fail without adding anything.
+    """
+    def __init__(self, playlists, history, unavailableIds=(), failedAdds=0):
+        self.playlists = {playlistId: {"title": title, "tracks": [self.ytmTrack(track) for track in tracks]}
+                          for playlistId, title, tracks in playlists}
+        self.history = [self.ytmTrack(track) for track in history]
+        self.setVideoIds = itertools.count()
+        self.unavailableIds = set(unavailableIds)
+        self.failedAdds = failedAdds
+        self.apiCalls = Counter()
+
+    @staticmethod
+    def ytmTrack(track):
+        # The purged keys plus some of the ones ytmusicapi returns and purgeFetchedPlaylist drops.
+        return {"videoId": track["videoId"], "title": track["title"], "artists": track["artists"],
+                "album": {"name": "Album", "id": None}, "duration": "3:30", "isAvailable": True, "thumbnails": []}
+
+    def get_history(self):
+        self.apiCalls["get_history"] += 1
+        return [dict(track) for track in self.history]
+
+    def get_library_playlists(self, limit=25):
+        self.apiCalls["get_library_playlists"] += 1
+        summaries = [{"playlistId": playlistId, "title": playlist["title"], "count": len(playlist["tracks"])}
+                     for playlistId, playlist in self.playlists.items()]
+        return summaries if limit is None else summaries[:limit]
+
+    def get_playlist(self, playlistId, limit=100):
+        self.apiCalls["get_playlist"] += 1
+        tracks = self.playlists.setdefault(playlistId, {"title": playlistId, "tracks": []})["tracks"]
+        return {"id": playlistId, "tracks": [dict(track) for track in (tracks if limit is None else tracks[:limit])]}
+
+    def remove_playlist_items(self, playlistId, videos):
+        self.apiCalls["remove_playlist_items"] += 1
+        removed = {video["setVideoId"] for video in videos}
+        playlist = self.playlists[playlistId]
+        playlist["tracks"] = [track for track in playlist["tracks"] if track.get("setVideoId") not in removed]
+        return "STATUS_SUCCEEDED"
+
+    def add_playlist_items(self, playlistId, videoIds, duplicates=False):
+        self.apiCalls["add_playlist_items"] += 1
+        tracks = self.playlists.setdefault(playlistId, {"title": playlistId, "tracks": []})["tracks"]
+        if self.failedAdds > 0:
+            # ytmusicapi returns the raw response of a failed edit, which has no status.
+            self.failedAdds -= 1
+            return {"error": {"code": 503, "message": "The service is currently unavailable."}}
+        editResults = []
+        for videoId in videoIds:
+            if videoId in self.unavailableIds:
+                editResults.append(None)
+                continue
+            tracks.append({"videoId": videoId, "title": videoId, "artists": [], "setVideoId": f"SV{next(self.setVideoIds)}"})
+            editResults.append({"videoId": videoId, "setVideoId": tracks[-1]["setVideoId"]})
+        return {"status": "STATUS_SUCCEEDED", "playlistEditResults": editResults}
+
+    def edit_playlist(self, playlistId, moveItem=None):
+        self.apiCalls["edit_playlist"] += 1
+        tracks = self.playlists[playlistId]["tracks"]
+        setVideoId, successor = (moveItem, None) if isinstance(moveItem, str) else moveItem
+        moved = next(track for track in tracks if track.get("setVideoId") == setVideoId)
+        tracks.remove(moved)
+        if successor is None:
+            tracks.append(moved)
+        else:
+            tracks.insert(next(i for i, track in enumerate(tracks) if track.get("setVideoId") == successor), moved)
+        return "STATUS_SUCCEEDED"
+
+    def create_playlist(self, title, description):
+        self.apiCalls["create_playlist"] += 1
+        playlistId = f"PLbenchmark{len(self.playlists)}"
+        self.playlists[playlistId] = {"title": title, "tracks": []}
+        return playlistId
+
+class FakeLastFmUser:
+    """
+    Local stand-in for pylast.User, serving synthetic top tracks and scrobbles without any network access.
+    The returned objects are real pylast TopItems and PlayedTracks. Every call is counted in apiCalls.
+    """
+    def __init__(self, topTracks, history):
+        self.network = pylast.LastFMNetwork(api_key="benchmark")
+        self.name = "benchmark"
+        self.topTracks = topTracks
+        self.history = history
+        self.apiCalls = Counter()
+
+    def get_top_tracks(self, period="overall", limit=None, cacheable=True, stream=False):
+        self.apiCalls["get_top_tracks"] += 1
+        return [pylast.TopItem(pylast.Track(artist, title, self.network), scrobbles)
+                for title, artist, scrobbles in self.topTracks[:limit]]
+
+    def get_recent_tracks(self, limit=10, cacheable=True, time_from=None, time_to=None, stream=False, now_playing=False):
+        self.apiCalls["get_recent_tracks"] += 1
+        playedTracks = []
+        for timestamp, title, artist in self.history:
+            if (time_from is None or timestamp >= time_from) and (time_to is None or timestamp <= time_to):
+                playedTracks.append(pylast.PlayedTrack(pylast.Track(artist, title, self.network), "Album",
+                                                       time.strftime("%d %b %Y, %H:%M", time.gmtime(timestamp)), str(timestamp)))
+        return playedTracks if limit is None else playedTracks[:limit]
+
+class FakeLastFmApi:
+    """
+    Local HTTP stand-in for the last.fm API, serving user.getRecentTracks in json pages from a synthetic scrobble history,
+    like ws.audioscrobbler.com does. Point "lastfm_api_url" in config.json to its url. Every request is counted in apiCalls,
+    and latency adds a delay to each one, like a real round trip would.
+    """
+    def __init__(self, history, latency=0.0):
+        self.history = history
+        self.latency = latency
+        self.apiCalls = Counter()
+        self.apiCallsLock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                status, body = api.respond(params)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/2.0/"
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, params):
+        time.sleep(self.latency)
+        method = params.get("method", "").lower()
+        with self.apiCallsLock:
+            self.apiCalls[method] += 1
+        if method != "user.getrecenttracks":
+            return 400, {"error": 3, "message": "Invalid Method - No method with that name in this package"}
+        limit = min(int(params.get("limit", 50)), 200)
+        page = int(params.get("page", 1))
+        timeFrom = int(params.get("from", 0))
+        timeTo = int(params.get("to", 2**31))
+        # Newest first, with the same range as FakeLastFmUser.get_recent_tracks.
+        scrobbles = [scrobble for scrobble in list(self.history) if timeFrom <= scrobble[0] <= timeTo]
+        totalPages = max(1, -(-len(scrobbles) // limit))
+        tracks = [{"artist": {"mbid": "", "#text": artist}, "name": title, "album": {"mbid": "", "#text": "Album"},
+                   "date": {"uts": str(timestamp), "#text": time.strftime("%d %b %Y, %H:%M", time.gmtime(timestamp))}}
+                  for timestamp, title, artist in scrobbles[(page - 1) * limit:page * limit]]
+        attributes = {"user": params.get("user", ""), "page": str(page), "perPage": str(limit),
+                      "totalPages": str(totalPages), "total": str(len(scrobbles))}
+        return 200, {"recenttracks": {"track": tracks, "@attr": attributes}}
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import random
+import string
+
+words = ("love night fire dance heart rain blue sky moon star dream girl boy baby time summer winter light dark "
+         "city road home ghost angel devil river ocean paradise gravity echo silence thunder shadow golden silver "
+         "neon midnight morning yesterday forever never always alone together lost found wild young old sweet "
+         "bitter broken electric cosmic velvet crystal paper glass stone sugar honey poison cherry lemon "
+         "kimi yume sora hana kokoro ame hikari yoru namida koi").split()
+syllables = "ka ki ku ke ko sa shi su se so ta chi tsu te to na ni nu ne no ma mi mu me mo ra ri ru re ro ya yu yo lo la li an el or is".split()
+suffixes = [" - Remastered", " - Live", " - Acoustic Version", " - Radio Edit", " (Remix)", " (Instrumental)", " (Cover)"]
+
+def makeArtistName(rng):
+    """
+    Creates a random artist name.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random generator.
+
+    Returns
+    -------
+    str
+        The artist name.
+    """
+    name = " ".join("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize() for _ in range(rng.randint(1, 2)))
+    if rng.random() < 0.05:
+        name = "The " + name
+    return name
+
+def makeArtists(count, seed=0):
+    """
+    Creates a pool of artists, some of them collaborations that ytmusicapi reports as a single artist ("A & B", "A, B", "A and B").
+
+    Parameters
+    ----------
+    count : int
+        The amount of artists.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    list
+        A list of ytmusicapi artist dictionaries.
+    """
+    rng = random.Random(seed)
+    artists = []
+    for i in range(count):
+        name = makeArtistName(rng)
+        if rng.random() < 0.08:
+            name = name + rng.choice([" & ", ", ", " and "]) + makeArtistName(rng)
+        artists.append({"name": name, "id": f"UC{i:022d}"})
+    return artists
+
+def makeTitle(rng):
+    """
+    Creates a random track title with some of the noise found in YTM titles.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random generator.
+
+    Returns
+    -------
+    str
+        The title.
+    """
+    title = " ".join(rng.choice(words) for _ in range(rng.randint(1, 5)))
+    title = title.title() if rng.random() < 0.8 else title
+    if rng.random() < 0.1:
+        title += rng.choice(suffixes)
+    return title
+
+def makeCompendium(size, seed=0):
+    """
+    Creates a synthetic compendium of purged ytmusicapi tracks. Around 5% of the tracks are other versions of earlier tracks,
+    and titles include featured artists and "Artist - Title" video names.
+
+    Parameters
+    ----------
+    size : int
+        The amount of tracks.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    list
+        A list of purged tracks (videoId, title, artists).
+    """
+    rng = random.Random(seed)
+    artists = makeArtists(max(10, size // 8), seed)
+    compendium = []
+    for i in range(size):
+        if compendium and rng.random() < 0.05:
+            original = rng.choice(compendium)
+            compendium.append({"videoId": f"{i:011d}", "title": original["title"], "artists": original["artists"]})
+            continue
+        trackArtists = [rng.choice(artists) for _ in range(1 if rng.random() < 0.85 else 2)]
+        title = makeTitle(rng)
+        if rng.random() < 0.1:
+            title += f" (feat. {rng.choice(artists)['name']})"
+        if rng.random() < 0.05:
+            title = f"{trackArtists[0]['name']} - {title}"
+        compendium.append({"videoId": f"{i:011d}", "title": title, "artists": trackArtists})
+    return compendium
+
+def makePlaylists(compendium, count, seed=0):
+    """
+    Splits a compendium into overlapping playlists, like a real library where the same track is in several playlists.
+
+    Parameters
+    ----------
+    compendium : list
+        A compendium created by makeCompendium.
+    count : int
+        The amount of playlists.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    list
+        A list of (playlistId, title, tracks) tuples.
+    """
+    rng = random.Random(seed)
+    playlists = [[] for _ in range(count)]
+    for track in compendium:
+        for playlist in rng.sample(playlists, 1 if rng.random() < 0.7 else min(count, 2)):
+            playlist.append(track)
+    return [(f"PL{i:032d}", f"Playlist {i}", tracks) for i, tracks in enumerate(playlists)]
+
+def distortTitle(title, rng):
+    """
+    Distorts a title the way last.fm titles differ from YTM ones: different casing, missing featured artists, typos.
+
+    Parameters
+    ----------
+    title : str
+        The YTM title.
+    rng : random.Random
+        The random generator.
+
+    Returns
+    -------
+    str
+        The distorted title.
+    """
+    if " - " in title and rng.random() < 0.5:
+        title = title.split(" - ")[-1]
+    title = title.split(" (feat.")[0]
+    if rng.random() < 0.5:
+        title = title.lower()
+    if len(title) > 12 and rng.random() < 0.3:
+        i = rng.randrange(len(title) - 1)
+        title = title[:i] + title[i + 1] + title[i] + title[i + 2:]
+    return title
+
+def makeTopTracks(compendium, count, missRate=0.1, seed=0):
+    """
+    Creates the last.fm top tracks of a user whose library is the compendium.
+
+    Parameters
+    ----------
+    compendium : list
+        A compendium created by makeCompendium.
+    count : int
+        The amount of top tracks.
+    missRate : float, optional
+        The fraction of top tracks that aren't in the compendium.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    list
+        A list of (title, artist, scrobbles) tuples, sorted by scrobbles in descending order.
+    """
+    rng = random.Random(seed)
+    topTracks = []
+    for rank in range(count):
+        scrobbles = max(1, int(120 / (rank + 1) ** 0.6))
+        if rng.random() < missRate:
+            topTracks.append(("".join(rng.choice(string.ascii_lowercase) for _ in range(12)), makeArtistName(rng), scrobbles))
+            continue
+        track = rng.choice(compendium)
+        artist = " & ".join(artist["name"] for artist in track["artists"])
+        topTracks.append((distortTitle(track["title"], rng), artist, scrobbles))
+    return topTracks
+
+def makeScrobbleHistory(topTracks, count, now, days=7, seed=0):
+    """
+    Creates a scrobble history for the top tracks, with tracks played on loop from time to time.
+
+    Parameters
+    ----------
+    topTracks : list
+        The top tracks created by makeTopTracks.
+    count : int
+        The amount of scrobbles.
+    now : int
+        The unix timestamp of the newest scrobble.
+    days : int, optional
+        The length of the history.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    list
+        A list of (timestamp, title, artist) tuples, newest first.
+    """
+    rng = random.Random(seed)
+    weights = [track[2] for track in topTracks]
+    step = days * 24 * 60 * 60 / max(1, count)
+    history = []
+    while len(history) < count:
+        title, artist, _ = rng.choices(topTracks, weights)[0]
+        for _ in range(1 if rng.random() < 0.9 else rng.randint(2, 8)):
+            history.append((int(now - len(history) * step), title, artist))
+    return history[:count]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+
+Measures a trigram index over the title variants of the compendium as a way to find fuzzy title matches without scoring
+every variant, against the full rapidfuzz scan, without touching the network.
+The index returns the variants whose trigrams could still give a fuzz.ratio over generator_engine.titleSimThreshold, and
+only those are scored. Its matches are checked to be exactly the ones of the full scan for every query; the script fails if not.
+Usage: python benchmarks/title_index.py [--sizes 10000 100000] [--queries 200]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import time
+import numpy as np
+from rapidfuzz import fuzz, process
+import compendium_engine as cE
+import generator_engine as gE
+import synthetic
+gramSize = 3
+
+def titleGrams(title):
+    """
+    Computes the trigrams of a title, each one packed into an integer (21 bits per character).
+
+    Parameters
+    ----------
+    title : str
+        The title.
+
+    Returns
+    -------
+    numpy.ndarray
+        The packed trigrams, in the order they appear in the title.
+    """
+    codes = np.frombuffer(title.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+def buildTitleGramIndex(variants):
+    """
+    Builds the trigram index of a list of title variants: for every trigram, the variants that have it and how many times.
+
+    Parameters
+    ----------
+    variants : list
+        The lowercase title variants.
+
+    Returns
+    -------
+    dict
+        The index, with the sorted trigrams ("grams"), where the postings of each one start ("starts"), the variant
+        ("variants") and trigram count ("counts") of every posting, and the length of every variant ("lengths").
+    """
+    lengths = np.fromiter(map(len, variants), dtype=np.int64, count=len(variants))
+    codes = np.frombuffer("".join(variants).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    gramCounts = np.maximum(lengths - gramSize + 1, 0)
+    firstGrams = np.cumsum(gramCounts) - gramCounts
+    owners = np.repeat(np.arange(len(variants)), gramCounts)
+    positions = np.repeat(np.cumsum(lengths) - lengths - firstGrams, gramCounts) + np.arange(gramCounts.sum())
+    grams, gramIds = np.unique((codes[positions] << 42) | (codes[positions + 1] << 21) | codes[positions + 2], return_inverse=True)
+    postings, counts = np.unique(gramIds * len(variants) + owners, return_counts=True)
+    starts = np.searchsorted(postings // len(variants), np.arange(len(grams) + 1))
+    return {"grams": grams, "starts": starts, "variants": postings % len(variants), "counts": counts, "lengths": lengths}
+
+def titleGramCandidates(titleLower, index):
+    """
+    Finds the variants of the index that could have a fuzz.ratio over titleSimThreshold with a title.
+    A ratio over the threshold allows at most dmax = (100 - threshold) * (len1 + len2) // 100 insertions and deletions, so
+    the lengths differ by at most dmax, and the titles share at least max(len1, len2) - 2 - 3 * dmax trigrams (each edit
+    breaks at most 3 of them). Variants that fail either bound can't match, so no match is ever left out.
+
+    Parameters
+    ----------
+    titleLower : str
+        The lowercase title of the track in last.fm.
+    index : dict
+        The index created by buildTitleGramIndex.
+
+    Returns
+    -------
+    numpy.ndarray
+        The candidate variants, in index order.
+    """
+    lengths = index["lengths"]
+    common = np.zeros(len(lengths), dtype=np.int64)
+    grams, counts = np.unique(titleGrams(titleLower), return_counts=True)
+    found = np.searchsorted(index["grams"], grams)
+    for gram, count, gramId in zip(grams, counts, found):
+        if gramId < len(index["grams"]) and index["grams"][gramId] == gram:
+            start, end = index["starts"][gramId], index["starts"][gramId + 1]
+            common[index["variants"][start:end]] += np.minimum(index["counts"][start:end], count)
+    titleLength = len(titleLower)
+    dmax = (100 - gE.titleSimThreshold) * (titleLength + lengths) // 100
+    possible = (np.abs(titleLength - lengths) <= dmax) & (common >= np.maximum(titleLength, lengths) - gramSize + 1 - gramSize * dmax)
+    return np.flatnonzero(possible)
+
+def measureSize(size, args):
+    """
+    Prints the build and query times of the index and of the full scan for a compendium size, and checks their matches.
+
+    Parameters
+    ----------
+    size : int
+        The amount of tracks in the compendium.
+    args : argparse.Namespace
+        The command line arguments.
+
+    Returns
+    -------
+    bool
+        True if the index found exactly the matches of the full scan for every query.
+    """
+    rawCompendium = synthetic.makeCompendium(size, args.seed)
+    variants = [variant for track in cE.toTracks(rawCompendium) for variant in track.titleVariants]
+    queries = [title.lower() for title, _, _ in synthetic.makeTopTracks(rawCompendium, args.queries, seed=args.seed)]
+    start = time.perf_counter()
+    index = buildTitleGramIndex(variants)
+    buildTime = time.perf_counter() - start
+    start = time.perf_counter()
+    indexMatches = []
+    candidateCount = 0
+    for query in queries:
+        candidates = titleGramCandidates(query, index)
+        candidateCount += len(candidates)
+        indexMatches.append({int(i) for i in candidates if fuzz.ratio(variants[i], query) > gE.titleSimThreshold})
+    indexTime = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = process.cdist(queries, variants, scorer=fuzz.ratio, score_cutoff=gE.titleSimThreshold, dtype=np.float64, workers=-1)
+    scanMatches = [set(np.flatnonzero(row > gE.titleSimThreshold).tolist()) for row in scores]
+    scanTime = time.perf_counter() - start
+    mismatches = sum(a != b for a, b in zip(indexMatches, scanMatches))
+    print(f"{size:>8} tracks, {len(variants)} variants, {len(index['grams'])} trigrams")
+    print(f"{'build index':<24} {buildTime:>10.3f} s")
+    print(f"{'index lookup':<24} {indexTime:>10.3f} s ({candidateCount / len(queries):.1f} candidates per query, "
+          f"{candidateCount / len(queries) / len(variants):.3%} of the variants)")
+    print(f"{'full scan':<24} {scanTime:>10.3f} s")
+    print(f"{'mismatched queries':<24} {mismatches:>10}")
+    return mismatches == 0
+
+def initialize():
+    """
+    Parses the command line arguments and runs the measurements.
+    """
+    parser = argparse.ArgumentParser(description="Title trigram index benchmark for ReplayMix+")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Compendium sizes to benchmark.")
+    parser.add_argument("--queries", type=int, default=200, help="Amount of last.fm titles looked up.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    args = parser.parse_args()
+    if not all([measureSize(size, args) for size in args.sizes]):
+        sys.exit("The index missed or added matches of the full scan.")
+
+initialize()
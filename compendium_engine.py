@@ -3,12 +3,158 @@
 Replay Mix+ by soreikomori
 https://github.com/soreikomori/ReplayMixPlus
 """
-from ytmusicapi import YTMusic
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
+import itertools
 import logging
 import json_tools as jt
+import compendium_store as cs
+import compendium_track as ct
+import ytm_client as ytm
+import metrics
+import os
+import json
+import hashlib
+import threading
+import time
 logger = logging.getLogger('rpmplusLogger')
+syncFile = "compendium_sync.json"
+jsonFile = "ytm_compendium.json"
+# Playlists are only fetched again when their summary changes, which misses edits that keep the track count. Every this many
+# days, every playlist is fetched again anyway. Change it with "compendium_full_refresh_days" in config.json (0 turns it off).
+defaultFullRefreshDays = 7
+# Warm copy of the compendium with its title lookup and artist index, reused until the revision of the store changes.
+compendiumCache = {"store": None, "revision": None, "compendium": None, "titleLookup": None, "artistIndex": None}
+compendiumCacheLock = threading.Lock()
 
-def removeDuplicates(playlist, compendium):
+def toTracks(compendium):
+    """
+    Turns a compendium in the format of ytm_compendium.json (a list of purged ytmusicapi tracks) into compendium tracks.
+
+    Parameters
+    ----------
+    compendium : list
+        A list of dictionaries with the videoId, title and artists of each track.
+
+    Returns
+    -------
+    list
+        The compendium tracks (Track records).
+    """
+    return [ct.makeTrack(track["videoId"], track["title"], track.get("artists")) for track in compendium]
+
+def buildTitleLookup(compendium):
+    """
+    Builds a dictionary from every normalized title variant to the tracks that have it, in compendium order.
+    Used as the exact-match fast path of generator_engine.checkYTMId.
+
+    Parameters
+    ----------
+    compendium : list
+        A compendium (list of Track records).
+
+    Returns
+    -------
+    dict
+        A dictionary with title variants as keys and lists of tracks as values.
+    """
+    titleLookup = {}
+    for track in compendium:
+        for title in track.titleVariants:
+            titleLookup.setdefault(title, []).append(track)
+    return titleLookup
+
+def buildArtistIndex(compendium):
+    """
+    Builds an inverted index from every normalized artist name to the positions of the tracks that have it, in compendium order.
+    Collaborations reported as a single artist ("A & B", "A and B", "A, B") are indexed under each of their artists,
+    like generator_engine.artistMatches compares them. Used to narrow generator_engine.checkYTMId down to the tracks of an artist.
+
+    Parameters
+    ----------
+    compendium : list
+        A compendium (list of Track records).
+
+    Returns
+    -------
+    dict
+        A dictionary with artist names as keys and lists of compendium positions as values.
+    """
+    artistIndex = {}
+    indexArtists(compendium, 0, artistIndex)
+    return artistIndex
+
+def indexArtists(tracks, firstPosition, artistIndex):
+    """
+    Adds tracks to an artist index.
+
+    Parameters
+    ----------
+    tracks : list
+        The tracks, in compendium order.
+    firstPosition : int
+        The position of the first track in the compendium.
+    artistIndex : dict
+        The index created by buildArtistIndex.
+    """
+    for position, track in enumerate(tracks, firstPosition):
+        # A track listing the same artist twice is indexed once.
+        for artistName in dict.fromkeys(track.artistNames):
+            artistIndex.setdefault(artistName, []).append(position)
+
+def trackSignature(track):
+    """
+    Creates the signature used to detect different versions of the same track: its normalized title and the sorted set of its artist names.
+
+    Parameters
+    ----------
+    track : Track
+        A compendium track.
+
+    Returns
+    -------
+    tuple
+        A hashable (title, artists) signature.
+    """
+    title = track.title.strip().casefold()
+    artists = tuple(sorted({name.strip().casefold() for name, _ in track.artists}))
+    return (title, artists)
+
+def buildCompendiumIndex(compendium):
+    """
+    Builds an in-memory index of the compendium so that duplicate checks are constant-time lookups.
+
+    Parameters
+    ----------
+    compendium : list
+        A compendium (list) usually loaded with loadCompendium.
+
+    Returns
+    -------
+    dict
+        A dictionary with the set of "videoIds" in the compendium and a "signatures" dictionary mapping each track signature to its videoId.
+    """
+    index = {"videoIds": set(), "signatures": {}}
+    for track in compendium:
+        indexTrack(track, index)
+    return index
+
+def indexTrack(track, index):
+    """
+    Adds a single track to a compendium index.
+
+    Parameters
+    ----------
+    track : Track
+        A compendium track.
+    index : dict
+        An index created by buildCompendiumIndex.
+    """
+    index["videoIds"].add(track.videoId)
+    index["signatures"].setdefault(trackSignature(track), track.videoId)
+
+def removeDuplicates(playlist, compendium, index=None):
     """
     Checks a compendium and the tracks in a playlist and adds non-duplicate tracks to it.
     To work correctly, this function needs to receive a PURGED playlist.
@@ -16,58 +162,263 @@ def removeDuplicates(playlist, compendium):
     Parameters
     ----------
     playlist : list
-        A purged playlist with ytmusicapi tracks (dictionaries).
+        A purged playlist (list of Track records).
     compendium : list
-        A compendium (list) usually fetched from ytm_compendium.json.
+        A compendium (list) usually loaded with loadCompendium.
+    index : dict, optional
+        An index of the compendium created by buildCompendiumIndex. It is kept up to date as tracks are added.
+        If not given, one is built from the compendium.
     
     Returns
     -------
     list
         The updated compendium with new tracks added.
     """
-    avoidDifVerDupes = jt.loadJson("config.json")["avoid_different_version_duplicates"]
-    for track in playlist:
-        logger.debug("Duplicate Remover - Checking track " + track["title"])
-        if track not in compendium:
-            if avoidDifVerDupes:
-                for compTrack in compendium:
-                    # Same Track, different ID (different album version)
-                    if track["title"] == compTrack["title"] and track["videoId"] != compTrack["videoId"]:
-                        # Same artists
-                        if sorted(artist["name"] for artist in track["artists"]) == sorted(artist["name"] for artist in compTrack["artists"]):
-                            logger.info("Duplicate found. Skipping.")
-                else:
-                    compendium.append(track)
-            else:
-                compendium.append(track)
+    if index is None:
+        index = buildCompendiumIndex(compendium)
+    avoidDifVerDupes = jt.loadJson(jt.configFile)["avoid_different_version_duplicates"]
+    compendium.extend(dedupeTracks(playlist, index, avoidDifVerDupes))
     return compendium
 
-def loadAllPlaylists():
+def dedupeTracks(tracks, index, avoidDifVerDupes):
+    """
+    Dedupe stage of the compendium pipeline. Yields the tracks that aren't in the compendium yet, adding them to its index as they pass.
+
+    Parameters
+    ----------
+    tracks : iterable
+        Purged ytmusicapi tracks.
+    index : dict
+        An index of the compendium created by buildCompendiumIndex or loadCompendiumIndex.
+    avoidDifVerDupes : bool
+        Whether other versions of a track already in the compendium (same title and artists, different videoId) are skipped too.
+
+    Yields
+    ------
+    Track
+        The tracks that are new to the compendium.
+    """
+    # Checked once, so the loop doesn't pay for a log call per track while debug logging is off.
+    debugEnabled = logger.isEnabledFor(logging.DEBUG)
+    for track in tracks:
+        if debugEnabled:
+            logger.debug("Duplicate Remover - Checking track %s", track.title)
+        if track.videoId in index["videoIds"]:
+            continue
+        # Same Track, different ID (different album version) and same artists
+        if avoidDifVerDupes and trackSignature(track) in index["signatures"]:
+            logger.info("Duplicate found. Skipping.")
+            continue
+        indexTrack(track, index)
+        yield track
+
+def loadAllPlaylists(fullRefresh=False):
     """
     Loads all playlists in a user's account into the compendium. This includes any regular playlist in the library, Liked Music, and the history.
     This function effectively creates or updates the entire compendium and it's the main function in this file.
+    Tracks are streamed through a fetch -> purge -> dedupe -> persist pipeline and written into the store in batches of
+    "compendium_write_batch" tracks (1000 by default), so the compendium is never loaded whole and an interrupted update keeps
+    what it had written. Playlists are fetched concurrently, with as many parallel fetches as the "playlist_fetch_workers" setting
+    in config.json (4 by default), and no more playlists than that are held in memory at once.
+    They are still merged into the compendium in library order, so the result is the same as fetching them one by one.
+    Only the playlists that changed since the last update (according to compendium_sync.json) and the new history entries are loaded,
+    except on a full refresh, which is done every "compendium_full_refresh_days" days (7 by default).
+
+    Parameters
+    ----------
+    fullRefresh : bool, optional
+        If True, every playlist is fetched regardless of the sync metadata.
     """
-    compendium = jt.loadJson("ytm_compendium.json")
-    if compendium == None:
+    migrateCompendium()
+    storedCount = cs.countTracks()
+    if storedCount == 0:
         logger.info("Compendium was empty.")
-        compendium = []
-    yt = YTMusic("auth.json")
-    history = purgeFetchedPlaylist(yt.get_history())
-    playlists = yt.get_library_playlists()
-    logger.info("Loading playlists into compendium...")
-    for playlist in playlists:
-        logger.debug("Evaluating playlist " + playlist["title"])
-        id = playlist["playlistId"]
-        purgedPls = purgeFetchedPlaylist(yt.get_playlist(id, None)["tracks"]) # type: ignore
-        logger.debug("Playlist fetched and purged.")
-        compendium = removeDuplicates(purgedPls, compendium)
-    compendium = removeDuplicates(history, compendium)
-    jt.writeIntoJson(compendium, "ytm_compendium.json")
-    logger.info("Compendium updated.")
+    syncData = jt.loadJson(syncFile)
+    refreshDays = jt.loadConfigValue("compendium_full_refresh_days", defaultFullRefreshDays)
+    if not fullRefresh and syncData and refreshDays and time.time() - syncData.get("fullRefreshAt", 0) >= refreshDays * 24 * 60 * 60:
+        logger.info(f"The last full refresh of the compendium was more than {refreshDays} days ago.")
+        fullRefresh = True
+    if fullRefresh or storedCount == 0 or not syncData:
+        syncData = {"playlists": {}, "history": [], "fullRefreshAt": time.time()}
+    with metrics.span("compendium_load"):
+        index = loadCompendiumIndex()
+    workers = max(1, jt.loadConfigValue("playlist_fetch_workers", 4))
+    batchSize = max(1, jt.loadConfigValue("compendium_write_batch", 1000))
+    avoidDifVerDupes = jt.loadJson(jt.configFile)["avoid_different_version_duplicates"]
+    yt = ytm.getClient()
+    with metrics.span("compendium_library_fetch"):
+        metrics.increment("api_calls", service="ytm", method="get_history")
+        history = purgeFetchedPlaylist(yt.get_history())
+        metrics.increment("api_calls", service="ytm", method="get_library_playlists")
+        playlists = yt.get_library_playlists(None)
+    changedPlaylists = [playlist for playlist in playlists if playlistChanged(playlist, syncData)]
+    logger.info(f"Loading playlists into compendium... ({len(changedPlaylists)} of {len(playlists)} changed)")
+    metrics.increment("playlists_skipped", len(playlists) - len(changedPlaylists))
+    seenHistory = set(syncData["history"])
+    with metrics.span("compendium_playlist_fetch"):
+        tracks = itertools.chain(streamPlaylistTracks(fetchPlaylists(yt, changedPlaylists, workers), syncData),
+                                 (track for track in history if track.videoId not in seenHistory))
+        added = persistTracks(dedupeTracks(tracks, index, avoidDifVerDupes), batchSize)
+    syncData["history"] = [track.videoId for track in history]
+    jt.writeIntoJson(syncData, syncFile)
+    metrics.increment("compendium_tracks_added", added)
+    logger.info(f"Compendium updated. {added} tracks added.")
+
+def loadCompendiumIndex():
+    """
+    Builds the index of the compendium in the store (see buildCompendiumIndex) by streaming its tracks, without loading the whole compendium.
+
+    Returns
+    -------
+    dict
+        The index of the compendium.
+    """
+    index = {"videoIds": set(), "signatures": {}}
+    for track in cs.iterateTracks():
+        indexTrack(track, index)
+    return index
+
+def fetchPlaylists(yt, playlists, workers):
+    """
+    Fetch stage of the compendium pipeline. Fetches the tracks of library playlists concurrently and yields them in library order.
+    At most workers playlists are fetched ahead of the one being consumed.
+
+    Parameters
+    ----------
+    yt : YTMusic
+        The authenticated ytmusicapi client.
+    playlists : list
+        Playlists as returned by get_library_playlists.
+    workers : int
+        The amount of parallel fetches.
+
+    Yields
+    ------
+    tuple
+        The playlist and its unpurged tracks.
+    """
+    remaining = iter(playlists)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        inFlight = deque((playlist, executor.submit(fetchPlaylistTracks, yt, playlist)) for playlist in itertools.islice(remaining, workers))
+        while inFlight:
+            playlist, future = inFlight.popleft()
+            tracks = future.result()
+            nextPlaylist = next(remaining, None)
+            if nextPlaylist is not None:
+                inFlight.append((nextPlaylist, executor.submit(fetchPlaylistTracks, yt, nextPlaylist)))
+            yield playlist, tracks
+
+def streamPlaylistTracks(fetchedPlaylists, syncData):
+    """
+    Purge stage of the compendium pipeline. Yields the purged tracks of every fetched playlist, and records each playlist in the
+    sync metadata once all of its tracks have gone through.
+
+    Parameters
+    ----------
+    fetchedPlaylists : iterable
+        (playlist, tracks) tuples, as yielded by fetchPlaylists.
+    syncData : dict
+        The sync metadata that will be saved into compendium_sync.json.
+
+    Yields
+    ------
+    Track
+        Purged tracks.
+    """
+    for playlist, tracks in fetchedPlaylists:
+        logger.debug("Evaluating playlist %s", playlist["title"])
+        yield from purgeTracks(tracks)
+        syncData["playlists"][playlist["playlistId"]] = {
+            "count": playlist.get("count"),
+            "fingerprint": playlistFingerprint(playlist)
+        }
+
+def persistTracks(tracks, batchSize):
+    """
+    Persist stage of the compendium pipeline. Appends the tracks to the compendium store in batches, one transaction each.
+
+    Parameters
+    ----------
+    tracks : iterable
+        Tracks that are new to the compendium.
+    batchSize : int
+        The amount of tracks written per transaction.
+
+    Returns
+    -------
+    int
+        The amount of tracks written.
+    """
+    added = 0
+    with closing(cs.openStore()) as conn:
+        for batch in iter(lambda: list(itertools.islice(tracks, batchSize)), []):
+            with metrics.span("compendium_write"):
+                revision = cs.appendTracks(batch, conn)
+            extendCompendiumCache(batch, revision)
+            added += len(batch)
+    return added
+
+def playlistFingerprint(playlist):
+    """
+    Creates a fingerprint of a playlist summary.
+
+    Parameters
+    ----------
+    playlist : dict
+        The playlist summary, as returned by get_library_playlists.
+
+    Returns
+    -------
+    str
+        The SHA-1 hex digest of the summary.
+    """
+    return hashlib.sha1(json.dumps(playlist, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def playlistChanged(playlist, syncData):
+    """
+    Checks whether a library playlist changed since it was last loaded into the compendium, using its summary from get_library_playlists.
+    Playlists without a track count in their summary are always considered changed.
+
+    Parameters
+    ----------
+    playlist : dict
+        A playlist as returned by get_library_playlists.
+    syncData : dict
+        The sync metadata loaded from compendium_sync.json.
+
+    Returns
+    -------
+    bool
+        True if the playlist has to be fetched again.
+    """
+    lastSeen = syncData["playlists"].get(playlist["playlistId"])
+    if lastSeen is None or playlist.get("count") is None:
+        return True
+    return lastSeen["count"] != playlist.get("count") or lastSeen["fingerprint"] != playlistFingerprint(playlist)
+
+def fetchPlaylistTracks(yt, playlist):
+    """
+    Fetches all the tracks of a library playlist.
+
+    Parameters
+    ----------
+    yt : YTMusic
+        The authenticated ytmusicapi client.
+    playlist : dict
+        A playlist as returned by get_library_playlists.
+
+    Returns
+    -------
+    list
+        The tracks, as returned by ytmusicapi.
+    """
+    metrics.increment("api_calls", service="ytm", method="get_playlist")
+    return yt.get_playlist(playlist["playlistId"], None)["tracks"] # type: ignore
 
 def purgeFetchedPlaylist(playlist):
     """
-    Removes all track data except videoId, title, and artists for each track in a playlist.
+    Removes all track data except videoId, title, and artists for each track in a playlist, keeping them in compact Track records.
+    The normalized title variants and artist names used for matching are computed here as well.
 
     Parameters
     ----------
@@ -77,18 +428,138 @@ def purgeFetchedPlaylist(playlist):
     Returns
     -------
     list
-        A purged playlist.
+        A purged playlist (list of Track records).
     """
-    purgedPlaylist = []
     logger.debug("Purging playlist...")
-    for track in playlist:
-        logger.debug("Purging track " + track["title"])
-        purgedPlaylist.append({"videoId": track["videoId"], "title": track["title"], "artists": track["artists"]})
-    return purgedPlaylist
+    return list(purgeTracks(playlist))
+
+def purgeTracks(tracks):
+    """
+    Lazy version of purgeFetchedPlaylist. Yields the purged tracks one by one.
+
+    Parameters
+    ----------
+    tracks : iterable
+        Tracks fetched from ytmusicapi.
+
+    Yields
+    ------
+    Track
+        A purged track.
+    """
+    debugEnabled = logger.isEnabledFor(logging.DEBUG)
+    for track in tracks:
+        if debugEnabled:
+            logger.debug("Purging track %s", track["title"])
+        yield ct.makeTrack(track["videoId"], track["title"], track["artists"])
+
+def loadCompendium():
+    """
+    Loads the compendium from the compendium store (ytm_compendium.db).
+    If the store is empty and was never filled, the compendium is migrated from ytm_compendium.json first.
+
+    Returns
+    -------
+    list
+        The compendium (list of Track records).
+    """
+    migrateCompendium()
+    return cs.loadTracks()
+
+def migrateCompendium():
+    """
+    Migrates ytm_compendium.json into the compendium store, if the store is empty and was never filled.
+    """
+    if cs.countTracks() == 0 and cs.loadMeta("migrated") is None:
+        if os.path.exists(jsonFile):
+            logger.info("Migrating " + jsonFile + " into the compendium store.")
+            importCompendium(jsonFile)
+        cs.saveMeta("migrated", "1")
+
+def loadCachedCompendium():
+    """
+    Loads the compendium with its title lookup and artist index, reusing the ones kept in memory if the store didn't change
+    since they were loaded. This keeps them warm across runs in the automated console's daemon mode.
+
+    Returns
+    -------
+    tuple
+        The compendium, its title lookup (see buildTitleLookup) and its artist index (see buildArtistIndex).
+        They are shared, so they must not be modified.
+    """
+    with compendiumCacheLock:
+        # The revision is read before the tracks, so a write in between only causes an extra reload later.
+        store = os.path.abspath(cs.storeFile)
+        revision = cs.loadRevision()
+        if compendiumCache["store"] != store or compendiumCache["revision"] != revision or compendiumCache["compendium"] is None:
+            logger.debug(f"Loading compendium revision {revision} into memory.")
+            compendium = loadCompendium()
+            # Loading may have migrated ytm_compendium.json, which writes a new revision.
+            compendiumCache.update(store=store, revision=cs.loadRevision() if revision == 0 else revision,
+                                   compendium=compendium, titleLookup=buildTitleLookup(compendium),
+                                   artistIndex=buildArtistIndex(compendium))
+            metrics.increment("cache_misses", cache="compendium")
+        else:
+            metrics.increment("cache_hits", cache="compendium")
+        return compendiumCache["compendium"], compendiumCache["titleLookup"], compendiumCache["artistIndex"]
+
+def extendCompendiumCache(tracks, revision):
+    """
+    Adds tracks appended to the store to the compendium kept in memory, instead of loading it again.
+    If the store was changed by someone else in between, the cache is left as is and reloaded on the next load.
+
+    Parameters
+    ----------
+    tracks : list
+        The tracks that were appended, at least one.
+    revision : int
+        The revision of the store after the append, which bumped it by one.
+    """
+    with compendiumCacheLock:
+        if (compendiumCache["compendium"] is None or compendiumCache["store"] != os.path.abspath(cs.storeFile)
+                or compendiumCache["revision"] != revision - 1):
+            return
+        indexArtists(tracks, len(compendiumCache["compendium"]), compendiumCache["artistIndex"])
+        compendiumCache["compendium"].extend(tracks)
+        for track in tracks:
+            for title in track.titleVariants:
+                compendiumCache["titleLookup"].setdefault(title, []).append(track)
+        compendiumCache["revision"] = revision
+
+def importCompendium(filename):
+    """
+    Replaces the compendium in the store with the one in a .json file. The sync metadata is reset, so the next update fetches every playlist.
+
+    Parameters
+    ----------
+    filename : str
+        The json filename, usually ytm_compendium.json.
+    """
+    compendium = jt.loadJson(filename)
+    if not isinstance(compendium, list):
+        compendium = []
+    cs.replaceTracks(toTracks(compendium))
+    jt.writeIntoJson({}, syncFile)
+    logger.info(f"Imported {len(compendium)} tracks from {filename}.")
+
+def exportCompendium(filename):
+    """
+    Exports the compendium in the store into a .json file, in the same format as the old ytm_compendium.json.
+
+    Parameters
+    ----------
+    filename : str
+        The json filename.
+    """
+    compendium = cs.loadTracks()
+    jt.writeIntoJson([{"videoId": track.videoId, "title": track.title, "artists": track.artistDicts()} for track in compendium], filename)
+    logger.info(f"Exported {len(compendium)} tracks into {filename}.")
 
 def resetCompendium():
     """
-    Resets the compendium by overwriting it with an empty list.
+    Resets the compendium by overwriting it with an empty list. The sync metadata is reset as well.
     """
     logger.info("Resetting compendium.")
-    jt.writeIntoJson([], "ytm_compendium.json")
\ No newline at end of file
+    cs.replaceTracks([])
+    cs.saveMeta("migrated", "1")
+    jt.writeIntoJson({}, syncFile)
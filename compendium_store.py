@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import sqlite3
+import json
+import logging
+import compendium_track as ct
+from contextlib import closing, nullcontext
+logger = logging.getLogger('rpmplusLogger')
+storeFile = "ytm_compendium.db"
+
+def openStore():
+    """
+    Opens the compendium store, creating it if it doesn't exist.
+    Tracks are kept in compendium order, with an index by videoId and another one by normalized title variant.
+    It also keeps the cache of last.fm to YTM matches.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection to ytm_compendium.db.
+    """
+    conn = sqlite3.connect(storeFile)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode, NORMAL still keeps every transaction atomic, but doesn't sync the disk on every commit of the batched writes.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS tracks (
+                        position INTEGER PRIMARY KEY,
+                        videoId TEXT,
+                        title TEXT NOT NULL,
+                        artists TEXT NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS tracksByVideoId ON tracks (videoId)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS titleVariants (
+                        variant TEXT NOT NULL,
+                        position INTEGER NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS titleVariantsByVariant ON titleVariants (variant)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS matches (
+                        title TEXT NOT NULL,
+                        artist TEXT NOT NULL,
+                        videoId TEXT,
+                        checkedCount INTEGER NOT NULL,
+                        checkedAt REAL NOT NULL,
+                        PRIMARY KEY (title, artist))""")
+    return conn
+
+def rowToTrack(row):
+    """
+    Turns a row of the tracks table into a compendium track.
+
+    Parameters
+    ----------
+    row : tuple
+        A (videoId, title, artists) row.
+
+    Returns
+    -------
+    Track
+        The compendium track.
+    """
+    return ct.trackFromJson(*row)
+
+def insertTracks(conn, tracks, firstPosition):
+    """
+    Inserts tracks into the store, starting at a given position. It has to be called inside a transaction.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+    tracks : list
+        The compendium tracks (Track records).
+    firstPosition : int
+        The position of the first track in the compendium.
+    """
+    # Tracks share their interned artists, so each artists tuple is only serialized once.
+    # Title variants and artist names aren't stored, trackFromJson computes them again. Stores created before that still have
+    # their (nullable) columns, so the inserted columns are named.
+    artistsJson = {}
+    for position, track in enumerate(tracks, firstPosition):
+        if track.artists not in artistsJson:
+            artistsJson[track.artists] = json.dumps(track.artistDicts())
+        conn.execute("INSERT INTO tracks (position, videoId, title, artists) VALUES (?, ?, ?, ?)",
+                     (position, track.videoId, track.title, artistsJson[track.artists]))
+        conn.executemany("INSERT INTO titleVariants VALUES (?, ?)", ((variant, position) for variant in track.titleVariants))
+
+def bumpRevision(conn):
+    """
+    Increments the revision of the store, so in-memory copies of the compendium know they are outdated.
+    It has to be called inside the transaction that changes the tracks.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+
+    Returns
+    -------
+    int
+        The new revision.
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+    revision = (0 if row is None else int(row[0])) + 1
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('revision', ?)", (str(revision),))
+    return revision
+
+def loadRevision():
+    """
+    Loads the revision of the store. It changes every time tracks are appended or replaced.
+
+    Returns
+    -------
+    int
+        The revision. 0 if the store was never written.
+    """
+    revision = loadMeta("revision")
+    return 0 if revision is None else int(revision)
+
+def loadTracks():
+    """
+    Loads the whole compendium from the store.
+
+    Returns
+    -------
+    list
+        The compendium tracks, in compendium order.
+    """
+    with closing(openStore()) as conn:
+        rows = conn.execute("SELECT videoId, title, artists FROM tracks ORDER BY position").fetchall()
+    return [rowToTrack(row) for row in rows]
+
+def iterateTracks(batchSize=1000):
+    """
+    Streams the compendium from the store, reading batchSize rows at a time.
+
+    Parameters
+    ----------
+    batchSize : int, optional
+        The amount of rows read at once.
+
+    Yields
+    ------
+    Track
+        The compendium tracks, in compendium order.
+    """
+    with closing(openStore()) as conn:
+        cursor = conn.execute("SELECT videoId, title, artists FROM tracks ORDER BY position")
+        for rows in iter(lambda: cursor.fetchmany(batchSize), []):
+            for row in rows:
+                yield rowToTrack(row)
+
+def countTracks():
+    """
+    Counts the tracks in the store.
+
+    Returns
+    -------
+    int
+        The amount of tracks in the compendium.
+    """
+    with closing(openStore()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+def appendTracks(tracks, conn=None):
+    """
+    Appends tracks to the end of the compendium in a single transaction. Either all of them are stored or none is.
+
+    Parameters
+    ----------
+    tracks : list
+        The compendium tracks (Track records) to append.
+    conn : sqlite3.Connection, optional
+        A connection returned by openStore, to reuse it across many appends. A new one is opened if not given.
+
+    Returns
+    -------
+    int
+        The revision of the store after the append. It only changes if there were tracks to append.
+    """
+    if len(tracks) == 0:
+        return loadRevision()
+    with closing(openStore()) if conn is None else nullcontext(conn) as conn:
+        with conn:
+            nextPosition = conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM tracks").fetchone()[0]
+            insertTracks(conn, tracks, nextPosition)
+            revision = bumpRevision(conn)
+    logger.info(f"Appended {len(tracks)} tracks to the compendium store.")
+    return revision
+
+def replaceTracks(tracks):
+    """
+    Replaces the whole compendium in a single transaction. If it fails, the previous compendium is kept.
+
+    Parameters
+    ----------
+    tracks : list
+        The compendium tracks (Track records).
+    """
+    with closing(openStore()) as conn:
+        with conn:
+            conn.execute("DELETE FROM titleVariants")
+            conn.execute("DELETE FROM tracks")
+            # Cached matches may point to tracks that aren't there anymore.
+            conn.execute("DELETE FROM matches")
+            insertTracks(conn, tracks, 0)
+            bumpRevision(conn)
+    logger.info(f"Wrote {len(tracks)} tracks into the compendium store.")
+
+def findByVideoId(videoId):
+    """
+    Finds a track in the compendium by its videoId.
+
+    Parameters
+    ----------
+    videoId : str
+        The videoId of the track.
+
+    Returns
+    -------
+    Track or None
+        The compendium track. None if it isn't in the compendium.
+    """
+    with closing(openStore()) as conn:
+        row = conn.execute("SELECT videoId, title, artists FROM tracks WHERE videoId = ? ORDER BY position LIMIT 1", (videoId,)).fetchone()
+    return None if row is None else rowToTrack(row)
+
+def findByTitle(title):
+    """
+    Finds the tracks in the compendium that have a given normalized title variant.
+
+    Parameters
+    ----------
+    title : str
+        A normalized (lowercase) title, as in the titleVariants of the tracks.
+
+    Returns
+    -------
+    list
+        The matching compendium tracks, in compendium order.
+    """
+    with closing(openStore()) as conn:
+        rows = conn.execute("""SELECT DISTINCT tracks.position, videoId, title, artists FROM tracks
+                               JOIN titleVariants ON titleVariants.position = tracks.position
+                               WHERE titleVariants.variant = ? ORDER BY tracks.position""", (title,)).fetchall()
+    return [rowToTrack(row[1:]) for row in rows]
+
+def loadMeta(key):
+    """
+    Loads a value from the metadata of the store.
+
+    Parameters
+    ----------
+    key : str
+        The metadata key.
+
+    Returns
+    -------
+    str or None
+        The stored value. None if it isn't set.
+    """
+    with closing(openStore()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+def saveMeta(key, value):
+    """
+    Saves a value into the metadata of the store.
+
+    Parameters
+    ----------
+    key : str
+        The metadata key.
+    value : str
+        The value to store.
+    """
+    with closing(openStore()) as conn:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+def loadMatches(keys):
+    """
+    Loads cached last.fm to YTM matches.
+
+    Parameters
+    ----------
+    keys : iterable
+        The (normalized title, normalized artist) pairs to look up: the lowercase title, and the artist as normalized by
+        generator_engine.normalizeArtistParam.
+
+    Returns
+    -------
+    dict
+        A dictionary with the pairs that are cached as keys and (videoId, checkedCount, checkedAt) tuples as values.
+        videoId is None for cached misses, checkedCount is the amount of tracks the compendium had when the match was
+        checked, and checkedAt is its unix timestamp.
+    """
+    matches = {}
+    with closing(openStore()) as conn:
+        for title, artist in keys:
+            row = conn.execute("SELECT videoId, checkedCount, checkedAt FROM matches WHERE title = ? AND artist = ?", (title, artist)).fetchone()
+            if row is not None:
+                matches[(title, artist)] = row
+    return matches
+
+def saveMatches(matches):
+    """
+    Saves last.fm to YTM matches into the cache, replacing the previous ones of the same pairs.
+
+    Parameters
+    ----------
+    matches : list
+        A list of (normalized title, normalized artist, videoId, checkedCount, checkedAt) tuples. See loadMatches.
+    """
+    with closing(openStore()) as conn:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)", matches)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import json
+import re
+artistSeparators = ["&", "and", ","]
+artistSplitPattern = re.compile('&|and|,')
+# Shared artist tables. Every (name, id) pair and every artists tuple is stored once, together with its normalized
+# artist names, and shared by all the tracks that have it.
+artistTable = {}
+# Artists tuple -> (artists tuple, normalized artist names)
+artistListTable = {}
+# Artists as stored in the compendium store (json) -> (artists tuple, normalized artist names)
+artistJsonTable = {}
+
+class Track:
+    """
+    A compendium track. A compact record with only the videoId, title and artists of a ytmusicapi track, plus the
+    normalized title variants and artist names used by generator_engine.checkYTMId.
+
+    Attributes
+    ----------
+    videoId : str
+        The videoId of the track.
+    title : str
+        The title of the track.
+    artists : tuple
+        The (name, id) pairs of its artists, interned in artistTable.
+    titleVariants : tuple
+        The lowercase title, without "(feat. ...)" and split at " - ", without repetitions.
+    artistNames : tuple
+        The lowercase artist names, with collaborations reported as a single artist ("A & B") split.
+    """
+    __slots__ = ("videoId", "title", "artists", "titleVariants", "artistNames")
+
+    def __init__(self, videoId, title, artists, artistNames):
+        self.videoId = videoId
+        self.title = title
+        self.artists = artists
+        self.artistNames = artistNames
+        self.titleVariants = normalizeTitle(title)
+
+    def __repr__(self):
+        return f"Track({self.videoId!r}, {self.title!r}, {self.artists!r})"
+
+    def artistDicts(self):
+        """
+        Returns the artists in the format of ytmusicapi.
+
+        Returns
+        -------
+        list
+            A list of {"name", "id"} dictionaries.
+        """
+        return [{"name": name, "id": artistId} for name, artistId in self.artists]
+
+def normalizeTitle(title):
+    """
+    Computes the normalized title variants of a track title.
+
+    Parameters
+    ----------
+    title : str
+        The title of the track.
+
+    Returns
+    -------
+    tuple
+        The title variants.
+    """
+    compendiumTitle = title.lower()
+    noFeatureTitle = compendiumTitle.split(" (feat.")[0].strip()
+    titleList = [compendiumTitle, noFeatureTitle] + compendiumTitle.split(" - ") + noFeatureTitle.split(" - ")
+    return tuple(dict.fromkeys(titleList))
+
+def normalizeArtistNames(artists):
+    """
+    Computes the normalized artist names of a track.
+
+    Parameters
+    ----------
+    artists : tuple
+        The (name, id) pairs of the artists.
+
+    Returns
+    -------
+    tuple
+        The artist names.
+    """
+    artistNames = [name for name, _ in artists]
+    # Logic for multiple artists in singular artist key
+    if len(artistNames) == 1 and any(separator in artistNames[0] for separator in artistSeparators):
+        artistNames = [name.strip() for name in artistSplitPattern.split(artistNames[0])]
+    return tuple(name.lower() for name in artistNames)
+
+def internArtists(artists):
+    """
+    Interns the artists of a track in the shared artist tables.
+
+    Parameters
+    ----------
+    artists : list
+        The artists as returned by ytmusicapi ({"name", "id"} dictionaries). None is the same as no artists.
+
+    Returns
+    -------
+    tuple
+        The interned artists tuple and its normalized artist names.
+    """
+    key = []
+    for artist in artists or []:
+        pair = (artist["name"], artist.get("id"))
+        key.append(artistTable.setdefault(pair, pair))
+    key = tuple(key)
+    entry = artistListTable.get(key)
+    if entry is None:
+        entry = artistListTable.setdefault(key, (key, normalizeArtistNames(key)))
+    return entry
+
+def makeTrack(videoId, title, artists):
+    """
+    Creates a compendium track from the keys of a ytmusicapi track.
+
+    Parameters
+    ----------
+    videoId : str
+        The videoId of the track.
+    title : str
+        The title of the track.
+    artists : list
+        The artists as returned by ytmusicapi.
+
+    Returns
+    -------
+    Track
+        The compendium track.
+    """
+    return Track(videoId, title, *internArtists(artists))
+
+def trackFromJson(videoId, title, artistsJson):
+    """
+    Creates a compendium track from its columns in the compendium store. Artists already seen are taken from the shared
+    tables by their json, without parsing it again. Title variants are computed again, which is faster than parsing the stored ones.
+
+    Parameters
+    ----------
+    videoId : str
+        The videoId of the track.
+    title : str
+        The title of the track.
+    artistsJson : str
+        The artists, as stored in json.
+
+    Returns
+    -------
+    Track
+        The compendium track.
+    """
+    entry = artistJsonTable.get(artistsJson)
+    if entry is None:
+        entry = artistJsonTable.setdefault(artistsJson, internArtists(json.loads(artistsJson)))
+    return Track(videoId, title, *entry)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import hashlib
+import importlib.metadata
+import json
+import os
+import re
+import sys
+cacheFile = ".dependency_check.json"
+requirementPattern = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:==\s*([^\s;#]+))?")
+
+def environmentFingerprint(requirementsFile):
+    """
+    Creates a fingerprint of requirements.txt and the interpreter environment.
+    It changes whenever the requirements, the interpreter, or the contents of any directory in sys.path with installed
+    distributions change (like when packages are installed). Other directories in sys.path are left out, as the one of the
+    script is also where the program writes its own files.
+
+    Parameters
+    ----------
+    requirementsFile : str
+        The requirements filename.
+
+    Returns
+    -------
+    str
+        The SHA-256 hex digest of the environment.
+    """
+    fingerprint = hashlib.sha256()
+    with open(requirementsFile, 'rb') as file:
+        fingerprint.update(file.read())
+    fingerprint.update(sys.executable.encode('utf-8'))
+    fingerprint.update(sys.version.encode('utf-8'))
+    for path in sys.path:
+        if isDistributionDirectory(path):
+            fingerprint.update(f"{path}:{os.stat(path).st_mtime_ns}".encode('utf-8'))
+    return fingerprint.hexdigest()
+
+def isDistributionDirectory(path):
+    """
+    Checks if a directory has installed distributions, like site-packages does.
+
+    Parameters
+    ----------
+    path : str
+        The directory.
+
+    Returns
+    -------
+    bool
+        True if the directory has any .dist-info or .egg-info entry.
+    """
+    try:
+        return any(name.endswith((".dist-info", ".egg-info")) for name in os.listdir(path))
+    except OSError:
+        return False
+
+def requirementsMet(requirementsFile):
+    """
+    Checks every requirement against the installed distributions with importlib.metadata.
+    Pinned requirements (name==version) need the exact version, any other requirement only needs to be installed.
+
+    Parameters
+    ----------
+    requirementsFile : str
+        The requirements filename.
+
+    Returns
+    -------
+    bool
+        True if every requirement is installed.
+    """
+    with open(requirementsFile, 'r') as file:
+        for line in file:
+            match = requirementPattern.match(line)
+            if match is None:
+                continue
+            name, version = match.groups()
+            try:
+                installedVersion = importlib.metadata.version(name)
+            except importlib.metadata.PackageNotFoundError:
+                return False  # A dependency is missing
+            if version is not None and installedVersion != version:
+                return False  # Version conflict exists
+    return True
+
+def checkDependencies(requirementsFile):
+    """
+    Checks if the dependencies are installed. The check is skipped if neither requirements.txt nor the environment changed since the last successful one.
+
+    Parameters
+    ----------
+    requirementsFile : str
+        The requirements filename.
+
+    Returns
+    -------
+    bool
+        True if every requirement is installed.
+    """
+    fingerprint = environmentFingerprint(requirementsFile)
+    try:
+        with open(cacheFile, 'r') as file:
+            if json.load(file).get("fingerprint") == fingerprint:
+                return True
+    except (FileNotFoundError, json.decoder.JSONDecodeError, AttributeError):
+        pass
+    if not requirementsMet(requirementsFile):
+        return False
+    with open(cacheFile, 'w') as file:
+        json.dump({"fingerprint": fingerprint}, file)
+    return True
@@ -3,17 +3,40 @@
 Replay Mix+ by soreikomori
 https://github.com/soreikomori/ReplayMixPlus
 """
-from ytmusicapi import YTMusic
 import time
+import bisect
 import pylast
 import logging
 import json_tools as jt
-from rapidfuzz import fuzz
-import re
+import compendium_engine as cE
+import compendium_store as cs
+import compendium_track as ct
+import scrobble_store as ss
+import ytm_client as ytm
+import metrics
+from rapidfuzz import fuzz, process
+import numpy as np
 
 ############### PRERUN FUNCTIONS ###############
 logger = logging.getLogger('rpmplusLogger')
-yt = YTMusic("auth.json")
+#### WEIGHTS
+# Note that these parameters are to be changed accordingly to what the user prefers the most.
+# I include my personal cocktail of weights. To change them, don't edit these lines: add a "score_weights"
+# dictionary with the same keys to config.json instead, e.g. {"scrobbles": 1, "recency": 0.7, "repetitions": 0.5}.
+defaultScoreWeights = {"scrobbles": 1, "recency": 0.7, "repetitions": 0.50}
+#### PERIOD AND WINDOW
+# Top tracks are fetched for "top_tracks_period" in config.json, and recency and repetitions are scored over the last
+# "scoring_window_days" days, which is the length of the period by default.
+defaultPeriod = "7day"
+periodDays = {"7day": 7, "1month": 30, "3month": 90, "6month": 180, "12month": 365, "overall": 365}
+lastFmCredsFile = "lastfmcreds.json"
+# Minimum fuzz.ratio scores (exclusive) for a last.fm title and artist to match the ones of a compendium track.
+titleSimThreshold = 90
+artistSimThreshold = 80
+# Seconds a cached "Could not find the track" result is trusted. Change it with "match_miss_ttl" in config.json.
+defaultMatchMissTtl = 7 * 24 * 60 * 60
+# The last.fm user is kept after the first connection, so later runs in the same process don't authenticate again.
+lastFmUser = None
 
 ############### SETUP FUNCTIONS ###############
 def lastFmNetworkConnect():
@@ -27,14 +50,30 @@ def lastFmNetworkConnect():
         The userSelf object that will be used to fetch the top tracks and recent tracks.
     """
     logger.info("Connecting to Last.FM Network...")
-    lastFmCreds = jt.loadJson("lastfmcreds.json")
-    network = pylast.LastFMNetwork(api_key=lastFmCreds['apikey'], api_secret=lastFmCreds['apisecret'],
-                               username=lastFmCreds['username'],
-                               password_hash=lastFmCreds['password'])
-    userSelf = network.get_user(lastFmCreds['username'])
+    with metrics.span("lastfm_connect"):
+        lastFmCreds = jt.loadJson(lastFmCredsFile)
+        network = pylast.LastFMNetwork(api_key=lastFmCreds['apikey'], api_secret=lastFmCreds['apisecret'],
+                                   username=lastFmCreds['username'],
+                                   password_hash=lastFmCreds['password'])
+        metrics.increment("api_calls", service="lastfm", method="auth.getMobileSession")
+        userSelf = network.get_user(lastFmCreds['username'])
     logger.info("Connected to Last.FM Network, returning UserSelf.")
     return userSelf
 
+def getLastFmUser():
+    """
+    Returns the connected last.fm user, connecting with lastFmNetworkConnect() the first time.
+
+    Returns
+    -------
+    pylast.User
+        The userSelf object that will be used to fetch the top tracks and recent tracks.
+    """
+    global lastFmUser
+    if lastFmUser is None:
+        lastFmUser = lastFmNetworkConnect()
+    return lastFmUser
+
 ############### IMPORT AND FETCHES ###############
 def fetchTopTracks(userSelf):
     """
@@ -53,30 +92,64 @@ def fetchTopTracks(userSelf):
     """
     # NOTES FOR PERIOD
     # Accepted values: overall | 7day | 1month | 3month | 6month | 12month
-    period = "7day"
+    period = loadPeriod()
     limit = 200
     logger.info("Fetching top tracks from Last.FM...")
-    return userSelf.get_top_tracks(period=period,limit=limit)
+    with metrics.span("lastfm_top_tracks"):
+        metrics.increment("api_calls", service="lastfm", method="user.getTopTracks")
+        metrics.increment("pages_fetched", service="lastfm", method="user.getTopTracks")
+        return userSelf.get_top_tracks(period=period,limit=limit)
+
+def loadPeriod():
+    """
+    Loads the period of the top tracks from the "top_tracks_period" setting of config.json.
+
+    Returns
+    -------
+    str
+        The last.fm period.
+    """
+    period = jt.loadConfigValue("top_tracks_period", defaultPeriod)
+    if period not in periodDays:
+        raise ValueError(f"top_tracks_period must be one of {', '.join(periodDays)}, not {period}.")
+    return period
+
+def loadWindowDays():
+    """
+    Loads the length of the scoring window from the "scoring_window_days" setting of config.json.
+
+    Returns
+    -------
+    int
+        The amount of days. The length of the top tracks period if it isn't set.
+    """
+    return jt.loadConfigValue("scoring_window_days", periodDays[loadPeriod()])
 
-def fetchRecentTracks(userSelf):
+def fetchScrobbleStats(userSelf, windowDays):
     """
-    Fetches all last.fm scrobbles for the past 7 days.
-    Do note that this takes rather long.
+    Fetches the scrobble statistics of the last windowDays days.
+    Only the scrobbles newer than the ones in the local scrobble store (scrobbles.db) are downloaded. The statistics are
+    merged from the daily rollups of the store, so longer windows don't cost more downloads, only more days to merge.
 
     Parameters
     ----------
     userSelf : pylast.User
         The userSelf function that lastFmNetworkConnect() returns.
+    windowDays : int
+        The length of the window in days.
 
     Returns
     -------
-    list
-        A list of PlayedTrack objects.
+    dict
+        The scrobble statistics of every title, like buildScrobbleStats returns them.
+    int
+        The unix timestamp where the statistics start. The rollups are made of whole UTC days, so it's the start of the day
+        windowDays days ago.
     """
-    #So far, this only supports 7 days according to the calculation below. I plan to add more days at a later version if there is demand for other timeframes.
-    sevenDaysAgo = round(time.time() - (7 * 24 * 60 * 60))
+    since = round(time.time() - windowDays * 24 * 60 * 60)
     logger.info("Fetching recent tracks from Last.FM...")
-    return userSelf.get_recent_tracks(time_from=sevenDaysAgo, limit=None)
+    with metrics.span("lastfm_recent_tracks"):
+        return ss.syncScrobbleStats(userSelf, since), ss.dayOf(since) * ss.daySeconds
 
 ############### MASTERLIST CREATION ###############
 def createMasterList():
@@ -88,103 +161,386 @@ def createMasterList():
     list
         A list of dictionaries, each containing the track's title, artist, YTM ID and score. The list is sorted by score in descending order.
     """
-    # Declarations
-    masterList = []
-    
+    #### PLAYLIST SIZE
+    # You can change this if you want your playlist to be bigger or smaller by setting "playlist_size" in config.json.
+    playlistSize = jt.loadConfigValue("playlist_size", 100)
+
     # Imports
-    userSelf = lastFmNetworkConnect()
+    userSelf = getLastFmUser()
     topTracks = fetchTopTracks(userSelf)
-    recentTracks = fetchRecentTracks(userSelf)
+    windowDays = loadWindowDays()
+    scrobbleStats, windowStart = fetchScrobbleStats(userSelf, windowDays)
     maxScrobbles = topTracks[0]._asdict()["weight"]
-    maxRepetitions = max(repetitionChecker(track.track.get_title(),recentTracks) for track in recentTracks)
-    uniqueIds = []
+    with metrics.span("compendium_load"):
+        compendium, titleLookup, artistIndex = cE.loadCachedCompendium()
 
     # Engine
-    logger.info("Creating MasterList...")
+    logger.info("Matching top tracks with the Compendium...")
+    fmTracks = []
     for track in topTracks:
         tiAsDict = track._asdict()
-        scrobbles = tiAsDict["weight"]
-        title = tiAsDict["item"].get_title()
-        artist = tiAsDict["item"].get_artist().get_name()
-        logger.debug(f"MASTERLIST - Processing last.fm track \"{title}\" with artist \"{artist}\"")
-        lastPlayed = lastPlayedChecker(title, recentTracks)
-        repetitions = repetitionChecker(title, recentTracks)
-        score = calcScore(scrobbles, lastPlayed, repetitions, maxScrobbles, maxRepetitions)
-        ytmId = checkYTMId(title, artist)
-        logger.debug("Track: " + title + " | Score: " + str(score))
-
+        fmTracks.append((tiAsDict["item"].get_title(), tiAsDict["item"].get_artist().get_name()))
+    with metrics.span("matching"):
+        ytmIds = cachedBatchCheckYTMIds(fmTracks, compendium, titleLookup, artistIndex)
+    logger.info("Creating MasterList...")
+    candidates = []
+    uniqueIds = set()
+    for track, (title, artist), ytmId in zip(topTracks, fmTracks, ytmIds):
+        logger.debug("MASTERLIST - Processing last.fm track \"%s\" with artist \"%s\"", title, artist)
         if ytmId != None and ytmId not in uniqueIds:
-            uniqueIds.append(ytmId)
-            # Declare Dictionary
-            trackDict = {
-                "title": title,
-                # "artist": artist,
-                "ytmid": ytmId,
-                "score": score
-            }
-            masterList.append(trackDict)
-        #### PLAYLIST SIZE
-        # You can change this if you want your playlist to be bigger or smaller.
-        # CHANGE THIS LINE -----
-        if len(masterList) == 100:
-            break
-        # ---------------------
+            uniqueIds.add(ytmId)
+            candidates.append((title, ytmId, track._asdict()["weight"]))
+    with metrics.span("scoring"):
+        # The scoring window can be shorter than the top tracks period, and hold no scrobbles at all.
+        maxRepetitions = max((stats["maxRepetitions"] for stats in scrobbleStats.values()), default=0)
+        scores = calcScores([candidate[2] for candidate in candidates],
+                            [lastPlayedChecker(candidate[0], scrobbleStats) for candidate in candidates],
+                            [repetitionChecker(candidate[0], scrobbleStats) for candidate in candidates],
+                            maxScrobbles, maxRepetitions, loadScoreWeights(), time.time() - windowStart)
+        topScores = selectTopScores(scores, playlistSize)
+    masterList = []
+    for i in topScores:
+        masterList.append({
+            "title": candidates[i][0],
+            # "artist": artist,
+            "ytmid": candidates[i][1],
+            "score": float(scores[i])
+        })
     logger.debug("MASTERLIST:")
     for track in masterList:
-        logger.debug("Track fm Title: " + track["title"] + " | Score: " + str(track["score"]))
+        logger.debug("Track fm Title: %s | Score: %s", track["title"], track["score"])
     logger.debug("-----------------")
     logger.info("MasterList created.")
-    return sorted(masterList, key=lambda x: x["score"], reverse=True)
+    return masterList
 
-def checkYTMId(givenTitle, artistParam):
+def checkYTMId(givenTitle, artistParam, compendium=None, titleLookup=None, artistIndex=None):
     """
     Does a cross-check between last.fm and YTM to find the YTM ID of the specific track to be added to the playlist.
+    Exact title matches are looked up first, and fuzzy matching is only done if none of them has a matching artist.
+    Fuzzy title matching only looks at the tracks of the artist, found with the artist index.
 
     Parameters
     ----------
     givenTitle : str
         The title of the track.
-    artist : str
-        The artist of the track. Currently unused.
+    artistParam : str
+        The artist of the track.
+    compendium : list, optional
+        A compendium (list of Track records). Loaded from the compendium store if not given.
+    titleLookup : dict, optional
+        The title lookup created by compendium_engine.buildTitleLookup for the compendium. Built if not given.
+    artistIndex : dict, optional
+        The artist index created by compendium_engine.buildArtistIndex for the compendium. Built if not given.
     
     Returns
     -------
     str or None
         The videoId of the track in the compendium. None if the track is not found.
     """
-    artistSimThreshold = 80
-    titleSimThreshold = 90
-    separators = ["&", "and", ","]
-    compendium = jt.loadJson("ytm_compendium.json")
-    logger.debug(f"Checking YTM ID for \"{givenTitle}\" with artist \"{artistParam}\"")
-    for track in compendium:
-        compendiumTitle = track["title"].lower()
-        noFeatureTitle = compendiumTitle.split(" (feat.")[0].strip()
-        dehyphenatedTitles = compendiumTitle.split(" - ")
-        noFeatureDehyphenatedTitles = noFeatureTitle.split(" - ")
-        titleList = [compendiumTitle, noFeatureTitle] + dehyphenatedTitles + noFeatureDehyphenatedTitles
-        for title in titleList:
-            if fuzz.ratio(title.lower(), givenTitle.lower()) > titleSimThreshold:
-                compendiumArtists = track.get('artists', [])
-                # Logic for multiple artists in singular artist key
-                if len(compendiumArtists) == 1 and any(separator in compendiumArtists[0]["name"] for separator in separators):
-                    splitName = re.split('&|and|,', compendiumArtists[0]["name"])
-                    compendiumArtists = [{"name": name.strip(), "id": None} for name in splitName]
-                    logger.debug(f"Found singular artist with multiple names, splitted: {compendiumArtists}")
-                for artistListed in compendiumArtists:
-                    # Logic for multiple artists in lastfm
-                    artistParamSplitted = re.split('&|and|,', artistParam)
-                    matchedArtistSplitted = any(fuzz.ratio(artistParamSplit.lower().strip(), artistListed['name'].lower()) > artistSimThreshold for artistParamSplit in artistParamSplitted)
-                    # Logic for single artist in lastfm
-                    matchedArtistNoSplit = fuzz.ratio(artistParam.lower(), artistListed['name'].lower()) > artistSimThreshold
-                    if matchedArtistSplitted or matchedArtistNoSplit:
-                        logger.debug(f"Match found! fmtitle: \"{title.lower()}\" - compendiumTitle: \"{compendiumTitle}\" - noFeatureTitle: \"{noFeatureTitle}\"")
-                        return track["videoId"]
-    logger.error("Could not find the track \"" + givenTitle + "\" in the Compendium.")
+    if compendium is None:
+        compendium = cE.loadCompendium()
+    if titleLookup is None:
+        titleLookup = cE.buildTitleLookup(compendium)
+    if artistIndex is None:
+        artistIndex = cE.buildArtistIndex(compendium)
+    logger.debug("Checking YTM ID for \"%s\" with artist \"%s\"", givenTitle, artistParam)
+    givenTitleLower = givenTitle.lower()
+    artistParam = normalizeArtistParam(artistParam)
+    artistParamSplitted = splitArtistParam(artistParam)
+    for track in titleLookup.get(givenTitleLower, []):
+        if artistMatches(track, artistParam, artistParamSplitted):
+            logger.debug("Exact match found! fmtitle: \"%s\" - compendiumTitle: \"%s\"", givenTitleLower, track.title)
+            return track.videoId
+    candidates = artistCandidates([(artistParam, artistParamSplitted)], artistIndex)[0]
+    videoId = matchTitle(givenTitleLower, candidates, compendium)
+    if videoId is None:
+        logger.error("Could not find the track \"%s\" in the Compendium.", givenTitle)
+    return videoId
+
+def artistCandidates(artists, artistIndex):
+    """
+    Finds the compendium tracks of many last.fm artists with the artist index. The artist names in the index are compared with
+    the same fuzzy check as artistMatches, so the candidates of an artist are exactly the tracks artistMatches accepts for it,
+    and title matching over them gives the same result as over the whole compendium.
+
+    Parameters
+    ----------
+    artists : list
+        A list of (artistParam, artistParamSplitted) tuples: the artist of a track in last.fm and its split by splitArtistParam.
+    artistIndex : dict
+        The artist index created by compendium_engine.buildArtistIndex.
+
+    Returns
+    -------
+    list
+        The sorted compendium positions of the tracks of each artist, in the same order as artists.
+    """
+    # Maximum amount of artist names scored in a single cdist call, to keep the score matrix small.
+    chunkSize = 20000
+    names = list(artistIndex)
+    if not names:
+        return [[] for _ in artists]
+    queries = []
+    owners = []
+    for i, (artistParam, artistParamSplitted) in enumerate(artists):
+        # Same comparisons as artistMatches: every split artist, and the whole artist for single artists in last.fm.
+        for query in artistParamSplitted + [artistParam.lower()]:
+            queries.append(query)
+            owners.append(i)
+    matched = [set() for _ in artists]
+    for start in range(0, len(names), chunkSize):
+        scores = process.cdist(queries, names[start:start + chunkSize], scorer=fuzz.ratio, score_cutoff=artistSimThreshold,
+                               dtype=np.float64, workers=-1)
+        metrics.increment("fuzzy_comparisons", scores.shape[0] * scores.shape[1])
+        for row, nameIndex in zip(*np.nonzero(scores > artistSimThreshold)):
+            matched[owners[row]].update(artistIndex[names[start + nameIndex]])
+    return [sorted(positions) for positions in matched]
+
+def matchTitle(titleLower, candidates, compendium):
+    """
+    Finds the first candidate track with a title variant similar enough to a last.fm title.
+
+    Parameters
+    ----------
+    titleLower : str
+        The lowercase title of the track in last.fm.
+    candidates : list
+        The sorted compendium positions of the tracks to look at, as returned by artistCandidates.
+    compendium : list
+        A compendium (list of Track records).
+
+    Returns
+    -------
+    str or None
+        The videoId of the track in the compendium. None if no candidate matches.
+    """
+    comparisons = 0
+    try:
+        for position in candidates:
+            track = compendium[position]
+            for title in track.titleVariants:
+                comparisons += 1
+                if fuzz.ratio(title, titleLower) > titleSimThreshold:
+                    logger.debug("Match found! fmtitle: \"%s\" - compendiumTitle: \"%s\" - matchedTitle: \"%s\"", titleLower, track.title, title)
+                    return track.videoId
+    finally:
+        metrics.increment("fuzzy_comparisons", comparisons)
     return None
 
+def batchCheckYTMIds(fmTracks, compendium, titleLookup=None, artistIndex=None):
+    """
+    Batch version of checkYTMId. Finds the YTM IDs of many last.fm tracks at once, giving the same results as calling checkYTMId for each of them.
+    Exact title matches are looked up first. The artists of the remaining tracks are looked up in the artist index in a single
+    rapidfuzz process.cdist call on all cores, and their titles are only scored against the tracks of their artist.
+
+    Parameters
+    ----------
+    fmTracks : list
+        A list of (title, artist) tuples from last.fm.
+    compendium : list
+        A compendium (list of Track records).
+    titleLookup : dict, optional
+        The title lookup created by compendium_engine.buildTitleLookup for the compendium. Built if not given.
+    artistIndex : dict, optional
+        The artist index created by compendium_engine.buildArtistIndex for the compendium. Built if not given.
+
+    Returns
+    -------
+    list
+        The videoId of each track in the compendium, in the same order as fmTracks. None for the tracks that were not found.
+    """
+    if titleLookup is None:
+        titleLookup = cE.buildTitleLookup(compendium)
+    if artistIndex is None:
+        artistIndex = cE.buildArtistIndex(compendium)
+    ytmIds = [None] * len(fmTracks)
+    pending = []
+    for i, (title, artist) in enumerate(fmTracks):
+        titleLower = title.lower()
+        artist = normalizeArtistParam(artist)
+        artistSplitted = splitArtistParam(artist)
+        for track in titleLookup.get(titleLower, []):
+            if artistMatches(track, artist, artistSplitted):
+                logger.debug("Exact match found! fmtitle: \"%s\" - compendiumTitle: \"%s\"", titleLower, track.title)
+                ytmIds[i] = track.videoId
+                break
+        else:
+            pending.append((i, titleLower, artist, artistSplitted))
+    if pending:
+        candidates = artistCandidates([(artist, artistSplitted) for _, _, artist, artistSplitted in pending], artistIndex)
+        for (i, titleLower, _, _), trackCandidates in zip(pending, candidates):
+            ytmIds[i] = matchTitle(titleLower, trackCandidates, compendium)
+            if ytmIds[i] is None:
+                logger.error("Could not find the track \"%s\" in the Compendium.", fmTracks[i][0])
+    return ytmIds
+
+def cachedBatchCheckYTMIds(fmTracks, compendium, titleLookup=None, artistIndex=None):
+    """
+    Finds the YTM IDs of many last.fm tracks like batchCheckYTMIds, but remembers the results in the match cache of the compendium store,
+    misses included. Only the tracks that aren't cached, or whose cached result may have changed, are matched again.
+    Tracks whose artists only differ in casing or spacing share their cache entry, since normalizeArtistParam makes them match the same tracks.
+    The compendium only grows by appending tracks (replacing it clears the cache), so a cached result stays valid unless a track
+    appended after it was checked has a title variant similar enough to pass the title threshold.
+    Cached misses are also matched again after "match_miss_ttl" seconds in config.json (7 days by default).
+
+    Parameters
+    ----------
+    fmTracks : list
+        A list of (title, artist) tuples from last.fm.
+    compendium : list
+        The compendium of the compendium store, e.g. from compendium_engine.loadCachedCompendium.
+    titleLookup : dict, optional
+        The title lookup created by compendium_engine.buildTitleLookup for the compendium. Built if not given.
+    artistIndex : dict, optional
+        The artist index created by compendium_engine.buildArtistIndex for the compendium. Built if not given.
+
+    Returns
+    -------
+    list
+        The videoId of each track in the compendium, in the same order as fmTracks. None for the tracks that were not found.
+    """
+    # Maximum amount of title variants scored in a single cdist call, to keep the score matrix small.
+    chunkSize = 20000
+    now = time.time()
+    missTtl = jt.loadConfigValue("match_miss_ttl", defaultMatchMissTtl)
+    keys = [(title.lower(), normalizeArtistParam(artist)) for title, artist in fmTracks]
+    cached = {key: entry for key, entry in cs.loadMatches(set(keys)).items()
+              if entry[1] <= len(compendium) and (entry[0] is not None or now - entry[2] < missTtl)}
+    stale = [key for key, entry in cached.items() if entry[1] < len(compendium)]
+    if stale:
+        # Only the variants of the tracks appended since the oldest stale entry was checked can change a result.
+        firstNew = min(cached[key][1] for key in stale)
+        variants = []
+        owners = []
+        for position in range(firstNew, len(compendium)):
+            for title in compendium[position].titleVariants:
+                variants.append(title)
+                owners.append(position)
+        owners = np.array(owners, dtype=np.int64)
+        invalidated = set()
+        for start in range(0, len(variants), chunkSize):
+            scores = process.cdist([key[0] for key in stale], variants[start:start + chunkSize], scorer=fuzz.ratio,
+                                   score_cutoff=titleSimThreshold, dtype=np.float64, workers=-1)
+            metrics.increment("fuzzy_comparisons", scores.shape[0] * scores.shape[1])
+            for row, key in enumerate(stale):
+                if np.any((scores[row] > titleSimThreshold) & (owners[start:start + chunkSize] >= cached[key][1])):
+                    invalidated.add(key)
+        logger.debug(f"Match cache: {len(invalidated)} of {len(stale)} entries invalidated by new compendium tracks.")
+        cs.saveMatches([(*key, cached[key][0], len(compendium), cached[key][2]) for key in stale if key not in invalidated])
+        for key in invalidated:
+            del cached[key]
+    uncached = {}
+    for (title, artist), key in zip(fmTracks, keys):
+        if key not in cached and key not in uncached:
+            uncached[key] = (title, artist)
+    matched = dict(zip(uncached, batchCheckYTMIds(list(uncached.values()), compendium, titleLookup, artistIndex))) if uncached else {}
+    cs.saveMatches([(*key, videoId, len(compendium), now) for key, videoId in matched.items()])
+    ytmIds = []
+    for (title, artist), key in zip(fmTracks, keys):
+        if key in cached:
+            metrics.increment("cache_hits", cache="matches")
+            if cached[key][0] is None:
+                logger.error("Could not find the track \"%s\" in the Compendium.", title)
+            ytmIds.append(cached[key][0])
+        else:
+            metrics.increment("cache_misses", cache="matches")
+            ytmIds.append(matched[key])
+    return ytmIds
+
+def normalizeArtistParam(artistParam):
+    """
+    Normalizes a last.fm artist name before matching it, so artists scrobbled with different casing or spacing match the same tracks.
+
+    Parameters
+    ----------
+    artistParam : str
+        The artist of the track in last.fm.
+
+    Returns
+    -------
+    str
+        The lowercase artist, with its whitespace collapsed into single spaces.
+    """
+    return " ".join(artistParam.lower().split())
+
+def splitArtistParam(artistParam):
+    """
+    Splits a last.fm artist name into the individual artists it may contain.
+
+    Parameters
+    ----------
+    artistParam : str
+        The artist of the track in last.fm.
+
+    Returns
+    -------
+    list
+        The lowercase, stripped artist names.
+    """
+    return [artistParamSplit.lower().strip() for artistParamSplit in ct.artistSplitPattern.split(artistParam)]
+
+def artistMatches(track, artistParam, artistParamSplitted):
+    """
+    Checks whether any of the artists of a compendium track matches the last.fm artist.
+
+    Parameters
+    ----------
+    track : Track
+        A compendium track.
+    artistParam : str
+        The artist of the track in last.fm.
+    artistParamSplitted : list
+        The artist split by splitArtistParam.
+
+    Returns
+    -------
+    bool
+        True if an artist matched.
+    """
+    artistParamLower = artistParam.lower()
+    for artistListed in track.artistNames:
+        # Logic for multiple artists in lastfm
+        matchedArtistSplitted = any(fuzz.ratio(artistParamSplit, artistListed) > artistSimThreshold for artistParamSplit in artistParamSplitted)
+        # Logic for single artist in lastfm
+        matchedArtistNoSplit = fuzz.ratio(artistParamLower, artistListed) > artistSimThreshold
+        if matchedArtistSplitted or matchedArtistNoSplit:
+            return True
+    return False
+
 ############### SCORE CALCULATION ###############
-def repetitionChecker(title, recentTracks):
+def buildScrobbleStats(recentTracks):
+    """
+    Builds a table with the scrobble statistics of every title in recentTracks in a single pass.
+
+    Parameters
+    ----------
+    recentTracks : list
+        A list of PlayedTrack objects, as returned by pylast. Newest scrobbles come first.
+
+    Returns
+    -------
+    dict
+        A dictionary with titles as keys. Each value is a dictionary with the "lastPlayed" unix timestamp,
+        the "maxRepetitions" (longest uninterrupted loop) and the "playCount" of the title.
+    """
+    scrobbleStats = {}
+    previousTitle = None
+    count = 0
+    for track in recentTracks:
+        title = track.track.get_title()
+        stats = scrobbleStats.get(title)
+        if stats is None:
+            # recentTracks is ordered newest first, so the first scrobble found is the last time it was played.
+            stats = {"lastPlayed": track.timestamp, "maxRepetitions": 0, "playCount": 0}
+            scrobbleStats[title] = stats
+        stats["playCount"] += 1
+        count = count + 1 if title == previousTitle else 1
+        if stats["maxRepetitions"] < count:
+            stats["maxRepetitions"] = count
+        previousTitle = title
+    return scrobbleStats
+
+def repetitionChecker(title, scrobbleStats):
     """
     Checks the maximum amount of repetitions (uninterrupted loops) for a given track.
 
@@ -192,31 +548,18 @@ def repetitionChecker(title, recentTracks):
     ----------
     title : str
         The title of the track.
-    recentTracks : list
-        A list of recent tracks in the selected timestamp, generated by fetchRecentTracks.
+    scrobbleStats : dict
+        The scrobble statistics of the recent tracks, generated by buildScrobbleStats or fetchScrobbleStats.
 
     Returns
     -------
     int
-        The maximum amount of repetitions for the given track. Returns 0 if the title is never found in recentTracks.
+        The maximum amount of repetitions for the given track. Returns 0 if the title is never found in the recent tracks.
     """
-    scrobbled = False
-    count = 0
-    max_count = 0
-    for track in recentTracks:
-        if track.track.get_title() == title:
-            scrobbled = True
-        else:
-            scrobbled = False
-        if scrobbled:
-            count += 1
-        else:
-            if max_count < count:
-                max_count = count
-            count = 0
-    return max_count
+    stats = scrobbleStats.get(title)
+    return stats["maxRepetitions"] if stats else 0
 
-def lastPlayedChecker(title, recentTracks):
+def lastPlayedChecker(title, scrobbleStats):
     """
     Finds the last time a track was played according to the recent tracks in last.fm.
 
@@ -224,22 +567,34 @@ def lastPlayedChecker(title, recentTracks):
     ----------
     title : str
         The title of the track.
-    recentTracks : list
-        A list of recent tracks in the selected timestamp, generated by fetchRecentTracks.
+    scrobbleStats : dict
+        The scrobble statistics of the recent tracks, generated by buildScrobbleStats or fetchScrobbleStats.
     
     Returns
     -------
     int or None
-        The unix timestamp of the last time the track was played. None if the title is never found in recentTracks.
+        The unix timestamp of the last time the track was played. None if the title is never found in the recent tracks.
     """
-    for track in recentTracks:
-        if track.track.get_title() == title:
-            return track.__getattribute__("timestamp")
-    return None
+    stats = scrobbleStats.get(title)
+    return stats["lastPlayed"] if stats else None
+
+def loadScoreWeights():
+    """
+    Loads the score weights, using the ones in the "score_weights" setting of config.json over the default ones.
+
+    Returns
+    -------
+    dict
+        A dictionary with the "scrobbles", "recency" and "repetitions" weights.
+    """
+    weights = dict(defaultScoreWeights)
+    weights.update(jt.loadConfigValue("score_weights", {}))
+    return weights
 
-def calcScore(scrobbles, lastPlayed, repetitions, maxScrobbles, maxRepetitions):
+def calcScore(scrobbles, lastPlayed, repetitions, maxScrobbles, maxRepetitions, weights=None, windowSeconds=604800):
     """
     Calculates the score of a track based on the algorithm in the return line.
+    This is the reference implementation of calcScores, for a single track.
 
     Parameters
     ----------
@@ -252,58 +607,279 @@ def calcScore(scrobbles, lastPlayed, repetitions, maxScrobbles, maxRepetitions):
     maxScrobbles : int
         The maximum scrobbles of any track in the selected timespan.
     maxRepetitions : int
-        The maximum number of repetitions of any track in the selected timestamp.
+        The maximum number of repetitions of any track in the selected timestamp. If it's 0 (no scrobbles in the window),
+        every track has a repetition value of 0.
+    weights : dict, optional
+        The score weights. defaultScoreWeights if not given.
+    windowSeconds : int, optional
+        The length of the scoring window in seconds. 604800 (7 days) if not given.
     
     Returns
     -------
     int
         The calculated score of the track.
     """
+    if weights is None:
+        weights = defaultScoreWeights
     # Calculations
     scroVal = scrobbles/maxScrobbles
-    # 604800 is the amount of seconds in 7 days.
-    lpVal = (time.time()-int(lastPlayed))/604800
-    repVal = repetitions/maxRepetitions
+    lpVal = (time.time()-int(lastPlayed))/windowSeconds
+    repVal = repetitions/maxRepetitions if maxRepetitions else 0
+    return weights["scrobbles"]*scroVal + weights["recency"]*(1-lpVal) + weights["repetitions"]*repVal
+
+def calcScores(scrobbles, lastPlayed, repetitions, maxScrobbles, maxRepetitions, weights=None, windowSeconds=604800):
+    """
+    Vectorized version of calcScore. Calculates the scores of many tracks at once.
+
+    Parameters
+    ----------
+    scrobbles : list
+        The amount of scrobbles of each track.
+    lastPlayed : list
+        The unix timestamp of the last time each track was found in last.fm. None is scored as if it was played at the start of the window.
+    repetitions : list
+        The maximum amount of repetitions (uninterrupted loops) of each track.
+    maxScrobbles : int
+        The maximum scrobbles of any track in the selected timespan.
+    maxRepetitions : int
+        The maximum number of repetitions of any track in the selected timestamp. If it's 0 (no scrobbles in the window),
+        every track has a repetition value of 0.
+    weights : dict, optional
+        The score weights. defaultScoreWeights if not given.
+    windowSeconds : int, optional
+        The length of the scoring window in seconds. 604800 (7 days) if not given.
+
+    Returns
+    -------
+    numpy.ndarray
+        The calculated score of each track, in the same order as the parameters.
+    """
+    if weights is None:
+        weights = defaultScoreWeights
+    now = time.time()
+    scroVal = np.asarray(scrobbles, dtype=np.float64)/maxScrobbles
+    lastPlayed = np.array([now - windowSeconds if played is None else int(played) for played in lastPlayed], dtype=np.float64)
+    lpVal = (now-lastPlayed)/windowSeconds
+    repVal = np.asarray(repetitions, dtype=np.float64)/maxRepetitions if maxRepetitions else np.zeros(len(repetitions))
+    return weights["scrobbles"]*scroVal + weights["recency"]*(1-lpVal) + weights["repetitions"]*repVal
 
-    #### WEIGHTS
-    # Note that these parameters are to be changed accordingly to what the user prefers the most.
-    # I include my personal cocktail of weights, but feel free to change it as you see fit.
-    # CHANGE THESE LINES -----
-    scrobbleWeight = 1
-    recenWeight = 0.7
-    repetitionWeight = 0.50
-    # ----------------------
+def selectTopScores(scores, size):
+    """
+    Selects the highest scores without sorting all of them.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        The scores calculated by calcScores.
+    size : int
+        The amount of scores to select.
 
-    return scrobbleWeight*scroVal + recenWeight*(1-lpVal) + repetitionWeight*repVal
+    Returns
+    -------
+    numpy.ndarray
+        The indexes of the selected scores, sorted by score in descending order. Ties keep their original order.
+    """
+    if size <= 0:
+        return np.arange(0)
+    if size < len(scores):
+        # The size-th highest score. Tracks tied with it only make the cut in their original order, like in a full stable sort.
+        threshold = np.partition(scores, len(scores) - size)[len(scores) - size]
+        above = np.flatnonzero(scores > threshold)
+        selected = np.sort(np.concatenate([above, np.flatnonzero(scores == threshold)[:size - len(above)]]))
+    else:
+        selected = np.arange(len(scores))
+    return selected[np.argsort(-scores[selected], kind="stable")]
 
 ############### YTM IMPLEMENTATION ###############
 def recreatePlaylist():
     """
-    Empties the ReplayMix+ playlist then readds all items in the MasterList in order.
+    Updates the ReplayMix+ playlist so that it contains all items in the MasterList in order.
     This is the only function that this entire script needs to run to work independently, as it calls all other functions.
     It will work as long as a compendium exists, and the playlistId is set in config.json.
     """
     logger.info("Playlist Recreation started.")
-    playlistId = jt.loadJson("config.json")["ytPlaylistId"]
-    currentTracks = yt.get_playlist(playlistId, None).get("tracks") # type: ignore
+    playlistId = jt.loadJson(jt.configFile)["ytPlaylistId"]
     videoIdList = []
     masterList = createMasterList()
     for track in masterList:
-        logger.debug("Playlist Recreation - Adding track " + track["title"] + " to the playlist.")
+        logger.debug("Playlist Recreation - Adding track %s to the playlist.", track["title"])
         videoIdList.append(track["ytmid"])
-    if len(currentTracks) > 0:
-        logger.info("Removing current tracks from the playlist. (Playlist was not empty.)")
-        yt.remove_playlist_items(playlistId, currentTracks)
-    logger.info("Adding new tracks to the playlist.")
-    time.sleep(25)
-    currentTracks = yt.get_playlist(playlistId, None).get("tracks") # type: ignore
-    while len(currentTracks) == 0:
-        logger.error("Playlist is empty. Retrying...")
-        yt.add_playlist_items(playlistId, videoIdList)
-        time.sleep(15)
-        currentTracks = yt.get_playlist(playlistId, None).get("tracks")
+    syncPlaylist(playlistId, videoIdList)
     logger.info("Playlist Recreation finished.")
 
+def syncPlaylist(playlistId, videoIdList):
+    """
+    Makes a YTM playlist contain exactly the given tracks in the given order, only removing, adding and moving the tracks that need it.
+    Tracks that YTM refuses to add (unavailable or region locked videos) are left out instead of being retried.
+
+    Parameters
+    ----------
+    playlistId : str
+        The ID of the playlist.
+    videoIdList : list
+        The videoIds the playlist should contain, in order. They must be unique.
+
+    Raises
+    ------
+    RuntimeError
+        If the playlist still misses tracks after every attempt to add them.
+    """
+    addAttempts = 3
+    yt = ytm.getClient()
+    targetIds = set(videoIdList)
+    metrics.increment("api_calls", service="ytm", method="get_playlist")
+    currentTracks = yt.get_playlist(playlistId, None).get("tracks") # type: ignore
+    keptIds = set()
+    removals = []
+    for track in currentTracks:
+        if track["videoId"] in targetIds and track["videoId"] not in keptIds:
+            keptIds.add(track["videoId"])
+        else:
+            removals.append(track)
+    if len(removals) > 0:
+        logger.info(f"Removing {len(removals)} tracks from the playlist.")
+        with metrics.span("playlist_removal"):
+            metrics.increment("api_calls", service="ytm", method="remove_playlist_items")
+            yt.remove_playlist_items(playlistId, removals)
+    rejectedIds = set()
+    with metrics.span("playlist_addition"):
+        for attempt in range(addAttempts):
+            additions = [videoId for videoId in videoIdList if videoId not in keptIds and videoId not in rejectedIds]
+            if len(additions) > 0:
+                logger.info(f"Adding {len(additions)} tracks to the playlist.")
+                metrics.increment("api_calls", service="ytm", method="add_playlist_items")
+                result = yt.add_playlist_items(playlistId, additions, duplicates=False)
+                refused = refusedVideoIds(result, additions)
+                if refused is None:
+                    # Nothing was added, so the same tracks are added again on the next attempt.
+                    logger.error(f"Adding tracks to the playlist failed: {result}")
+                    if attempt < addAttempts - 1:
+                        time.sleep(2 ** attempt)
+                    continue
+                if len(refused) > 0:
+                    # Unavailable or region locked videos are refused every time, so they aren't added again nor waited for.
+                    logger.warning(f"YTM refused to add {len(refused)} tracks to the playlist: {', '.join(sorted(refused))}")
+                    rejectedIds |= refused
+            expectedIds = targetIds - rejectedIds
+            currentTracks = waitForPlaylist(playlistId, lambda tracks: sorted(track["videoId"] for track in tracks) == sorted(expectedIds))
+            keptIds = {track["videoId"] for track in currentTracks}
+            if keptIds == expectedIds:
+                break
+            logger.error("Playlist doesn't have the expected tracks. Retrying...")
+        else:
+            missing = len(targetIds - rejectedIds - keptIds)
+            raise RuntimeError(f"The playlist is still missing {missing} tracks after {addAttempts} attempts to add them.")
+    setVideoIds = {track["videoId"]: track["setVideoId"] for track in currentTracks}
+    targetOrder = [videoId for videoId in videoIdList if videoId in setVideoIds]
+    moves = planPlaylistMoves([track["videoId"] for track in currentTracks if track["videoId"] in targetIds], targetOrder)
+    if len(moves) > 0:
+        logger.info(f"Moving {len(moves)} tracks in the playlist.")
+        with metrics.span("playlist_moves"):
+            for videoId, successorId in moves:
+                metrics.increment("api_calls", service="ytm", method="edit_playlist")
+                yt.edit_playlist(playlistId, moveItem=setVideoIds[videoId] if successorId is None else (setVideoIds[videoId], setVideoIds[successorId]))
+            waitForPlaylist(playlistId, lambda tracks: [track["videoId"] for track in tracks] == targetOrder)
+
+def refusedVideoIds(result, videoIds):
+    """
+    Reads which videoIds YTM refused from the result of add_playlist_items, which has an empty entry for each of them.
+
+    Parameters
+    ----------
+    result : dict or str
+        The result of add_playlist_items.
+    videoIds : list
+        The videoIds that were added, in the same order.
+
+    Returns
+    -------
+    set or None
+        The refused videoIds. None if the whole request failed.
+    """
+    if not isinstance(result, dict):
+        return set() if "SUCCEEDED" in str(result) else None
+    if "SUCCEEDED" not in result.get("status", ""):
+        return None
+    return {videoId for videoId, editResult in zip(videoIds, result.get("playlistEditResults", [])) if editResult is None}
+
+def waitForPlaylist(playlistId, condition):
+    """
+    Polls a YTM playlist with exponential backoff until its tracks fulfill a condition, or gives up after a while.
+
+    Parameters
+    ----------
+    playlistId : str
+        The ID of the playlist.
+    condition : function
+        Receives the list of tracks in the playlist and returns True once they are as expected.
+
+    Returns
+    -------
+    list
+        The last fetched tracks of the playlist.
+    """
+    yt = ytm.getClient()
+    delay = 1
+    maxDelay = 16
+    timeout = 120
+    waited = 0
+    metrics.increment("api_calls", service="ytm", method="get_playlist")
+    currentTracks = yt.get_playlist(playlistId, None).get("tracks") # type: ignore
+    while not condition(currentTracks):
+        if waited >= timeout:
+            logger.error(f"Playlist didn't reach the expected state after {waited} seconds.")
+            break
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, maxDelay)
+        metrics.increment("api_calls", service="ytm", method="get_playlist")
+        currentTracks = yt.get_playlist(playlistId, None).get("tracks") # type: ignore
+    return currentTracks
+
+def planPlaylistMoves(currentIds, targetIds):
+    """
+    Plans the smallest set of moves that turns the current order of a playlist into the target order.
+    The tracks in the longest subsequence that is already in target order stay in place, and every other track is moved.
+
+    Parameters
+    ----------
+    currentIds : list
+        The videoIds in the playlist, in their current order.
+    targetIds : list
+        The same videoIds in the target order.
+
+    Returns
+    -------
+    list
+        A list of (videoId, successorId) tuples, to be applied in order. Each track has to be moved right before its successor,
+        or to the end of the playlist if the successor is None.
+    """
+    targetPositions = {videoId: position for position, videoId in enumerate(targetIds)}
+    sequence = [targetPositions[videoId] for videoId in currentIds]
+    # Longest increasing subsequence (patience sorting), keeping the predecessor of every element to rebuild it.
+    tails = []
+    tailIndexes = []
+    predecessors = [None] * len(sequence)
+    for i, position in enumerate(sequence):
+        slot = bisect.bisect_left(tails, position)
+        predecessors[i] = tailIndexes[slot - 1] if slot > 0 else None
+        if slot == len(tails):
+            tails.append(position)
+            tailIndexes.append(i)
+        else:
+            tails[slot] = position
+            tailIndexes[slot] = i
+    inPlace = set()
+    i = tailIndexes[-1] if tailIndexes else None
+    while i is not None:
+        inPlace.add(sequence[i])
+        i = predecessors[i]
+    moves = []
+    for position in reversed(range(len(targetIds))):
+        if position not in inPlace:
+            moves.append((targetIds[position], targetIds[position + 1] if position + 1 < len(targetIds) else None))
+    return moves
+
 ############### CONSOLE HELPER FUNCTIONS ###############
 
 def createPlaylist(name, desc):
@@ -322,4 +898,4 @@ def createPlaylist(name, desc):
     str
         The playlist ID of the newly created playlist.
     """
-    return yt.create_playlist(name, desc)
\ No newline at end of file
+    return ytm.getClient().create_playlist(name, desc)
\ No newline at end of file
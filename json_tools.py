@@ -6,11 +6,21 @@ https://github.com/soreikomori/ReplayMixPlus
 import json
 import logging
 import os
+import copy
+import threading
+import metrics
+from collections import OrderedDict
 logger = logging.getLogger('rpmplusLogger')
+configFile = "config.json"
+# Parsed .json files, by absolute path, with the mtime and size they had when they were parsed. Least recently used first.
+jsonCache = OrderedDict()
+# Upper bound for the cache, measured in bytes of the cached files on disk.
+jsonCacheMaxBytes = 32 * 1024 * 1024
+jsonCacheLock = threading.Lock()
 
 def writeIntoJson(content, filename):
     """
-    Writes into a .json file.
+    Writes into a .json file atomically.
 
     Parameters
     ----------
@@ -19,13 +29,21 @@ def writeIntoJson(content, filename):
     filename : str
         The json filename.
     """
-    with open(filename, 'w') as file:
-        logger.info("Wrote into " + filename)
+    # Written into a temporary file first, then moved over the old one, so that a crash never leaves a half written file.
+    tempFilename = filename + ".tmp"
+    with open(tempFilename, 'w') as file:
         json.dump(content, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tempFilename, filename)
+    invalidateJsonCache(filename)
+    logger.info("Wrote into " + filename)
 
 def loadJson(filename):
     """
     Loads a .json file.
+    Parsed files are cached in memory and only parsed again when their modification time or size changes.
+    Every call returns its own copy, so changing the result never changes the cache.
 
     Parameters
     ----------
@@ -37,17 +55,82 @@ def loadJson(filename):
     dict or None
         The loaded .json file. None if the file was not found.
     """
+    key = os.path.abspath(filename)
     try:
+        stat = os.stat(filename)
+        with jsonCacheLock:
+            cached = jsonCache.get(key)
+            if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                jsonCache.move_to_end(key)
+                metrics.increment("cache_hits", cache="json")
+                data = cached[2]
+                return copy.deepcopy(data) if data else None
+        metrics.increment("cache_misses", cache="json")
         with open(filename, 'r') as file:
             data = json.load(file)
-            if data:
-                return data
+        cacheJson(key, stat, data)
+        if data:
+            return copy.deepcopy(data)
     except FileNotFoundError:
         logger.error("The file " + filename + " was not found.")
         return None
     except json.decoder.JSONDecodeError:
         logger.error("The file " + filename + " was empty.")
         return {}
+
+def cacheJson(key, stat, data):
+    """
+    Stores a parsed .json file in the cache, evicting the least recently used files if it gets too big.
+
+    Parameters
+    ----------
+    key : str
+        The absolute path of the file.
+    stat : os.stat_result
+        The stat of the file before it was parsed.
+    data : dict or list
+        The parsed content.
+    """
+    if stat.st_size > jsonCacheMaxBytes:
+        return
+    with jsonCacheLock:
+        jsonCache[key] = (stat.st_mtime_ns, stat.st_size, data)
+        jsonCache.move_to_end(key)
+        while sum(cached[1] for cached in jsonCache.values()) > jsonCacheMaxBytes:
+            jsonCache.popitem(last=False)
+
+def invalidateJsonCache(filename):
+    """
+    Removes a file from the cache of loadJson.
+
+    Parameters
+    ----------
+    filename : str
+        The json filename.
+    """
+    with jsonCacheLock:
+        jsonCache.pop(os.path.abspath(filename), None)
+
+def loadConfigValue(key, default=None):
+    """
+    Loads a single setting from config.json (configFile).
+
+    Parameters
+    ----------
+    key : str
+        The setting name.
+    default : any, optional
+        The value returned if config.json or the setting is missing.
+
+    Returns
+    -------
+    any
+        The value of the setting, or the default.
+    """
+    config = loadJson(configFile)
+    if not config:
+        return default
+    return config.get(key, default)
     
 def createJson(filename):
     """
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+import pylast
+import requests
+from requests.adapters import HTTPAdapter
+import json_tools as jt
+import metrics
+logger = logging.getLogger('rpmplusLogger')
+# The last.fm API endpoint. Change it with "lastfm_api_url" in config.json (a local stand-in, a proxy...).
+defaultApiUrl = "https://ws.audioscrobbler.com/2.0/"
+# The largest page user.getRecentTracks serves.
+pageSize = 200
+# last.fm error codes that are worth retrying: operation failed, service offline, temporarily unavailable, rate limit exceeded.
+retryableErrors = {8, 11, 16, 29}
+maxAttempts = 3
+
+def createSession(workers):
+    """
+    Creates the HTTP session shared by every page request of a fetch, with a connection for each worker.
+
+    Parameters
+    ----------
+    workers : int
+        The amount of parallel page requests.
+
+    Returns
+    -------
+    requests.Session
+        The pooled session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "ReplayMixPlus"
+    return session
+
+def fetchPage(session, apiUrl, params, page):
+    """
+    Fetches a single page of user.getRecentTracks, retrying the errors last.fm reports as temporary.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session created by createSession.
+    apiUrl : str
+        The last.fm API endpoint.
+    params : dict
+        The request parameters, without the page.
+    page : int
+        The page number, starting at 1.
+
+    Returns
+    -------
+    dict
+        The "recenttracks" object of the response.
+
+    Raises
+    ------
+    pylast.WSError
+        If last.fm answers with an error.
+    pylast.NetworkError
+        If last.fm can't be reached.
+    """
+    for attempt in range(1, maxAttempts + 1):
+        try:
+            response = session.get(apiUrl, params=dict(params, page=page), timeout=30)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            if attempt == maxAttempts:
+                raise pylast.NetworkError(None, e) from e
+            # The message of the exception has the request url, with the api key in it.
+            reason = type(e).__name__
+        else:
+            error = data.get("error")
+            if error is None and response.ok:
+                metrics.increment("api_calls", service="lastfm", method="user.getRecentTracks")
+                metrics.increment("pages_fetched", service="lastfm", method="user.getRecentTracks")
+                return data["recenttracks"]
+            retryable = error in retryableErrors if error is not None else response.status_code >= 500
+            if not retryable or attempt == maxAttempts:
+                raise pylast.WSError(None, str(error or response.status_code), data.get("message", response.reason))
+            reason = f"error {error or response.status_code}"
+        logger.warning("Recent tracks page %d failed (%s), retrying...", page, reason)
+        time.sleep(attempt)
+
+def pageTracks(recentTracks):
+    """
+    Returns the scrobbles in a page, without the track that is playing now.
+
+    Parameters
+    ----------
+    recentTracks : dict
+        The "recenttracks" object of a user.getRecentTracks response.
+
+    Returns
+    -------
+    list
+        The track objects of the page.
+    """
+    tracks = recentTracks.get("track", [])
+    # A page with a single track has it as an object instead of a list.
+    if isinstance(tracks, dict):
+        tracks = [tracks]
+    return [track for track in tracks if "date" in track and not track.get("@attr", {}).get("nowplaying")]
+
+def fetchRecentTracks(userSelf, timeFrom, timeTo=None):
+    """
+    Fetches every scrobble of a user in a time range, like userSelf.get_recent_tracks(time_from=timeFrom, limit=None),
+    but with the pages downloaded in parallel. The first page tells how many pages there are, and the rest of them are fetched
+    by a pool of "lastfm_page_workers" threads (4 by default). The range ends at the time of the first request, so scrobbles
+    made while fetching don't shift the pages. Scrobbles repeated at the edge of two pages are only kept once.
+
+    Parameters
+    ----------
+    userSelf : pylast.User
+        The userSelf object that generator_engine.lastFmNetworkConnect() returns.
+    timeFrom : int
+        The unix timestamp of the start of the range.
+    timeTo : int, optional
+        The unix timestamp of the end of the range. By default, now.
+
+    Returns
+    -------
+    list
+        A list of PlayedTrack objects, newest first, like pylast returns them.
+    """
+    network = userSelf.network
+    apiUrl = jt.loadConfigValue("lastfm_api_url", defaultApiUrl)
+    workers = max(1, jt.loadConfigValue("lastfm_page_workers", 4))
+    params = {"method": "user.getRecentTracks", "user": userSelf.name, "api_key": network.api_key, "format": "json",
+              "limit": pageSize, "from": timeFrom, "to": timeTo or int(time.time())}
+    with createSession(workers) as session:
+        firstPage = fetchPage(session, apiUrl, params, 1)
+        totalPages = int(firstPage.get("@attr", {}).get("totalPages", 1))
+        pages = [firstPage]
+        if totalPages > 1:
+            logger.debug("Fetching %d pages of recent tracks with %d workers.", totalPages, workers)
+            with ThreadPoolExecutor(max_workers=min(workers, totalPages - 1)) as executor:
+                pages.extend(executor.map(lambda page: fetchPage(session, apiUrl, params, page), range(2, totalPages + 1)))
+    playedTracks = []
+    seen = set()
+    for page in pages:
+        for track in pageTracks(page):
+            timestamp = track["date"]["uts"]
+            key = (timestamp, track["name"], track["artist"]["#text"])
+            if key in seen:
+                continue
+            seen.add(key)
+            playedTracks.append(pylast.PlayedTrack(pylast.Track(track["artist"]["#text"], track["name"], network),
+                                                   track["album"]["#text"] or None, track["date"]["#text"] or None, timestamp))
+    return playedTracks
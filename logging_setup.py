@@ -3,19 +3,69 @@
 Replay Mix+ by soreikomori
 https://github.com/soreikomori/ReplayMixPlus
 """
+import atexit
 import logging
-def setup_logger(verbose):
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import json_tools as jt
+# rpmplus.log is rotated when it reaches this size, keeping this many old logs (rpmplus.log.1, .2...).
+# Change them with "log_max_bytes" and "log_backup_count" in config.json.
+defaultMaxBytes = 5 * 2**20
+defaultBackupCount = 3
+# The listener that writes the queued records into the log file, in its own thread.
+listener = None
+
+class LogQueueHandler(QueueHandler):
+    """
+    A QueueHandler for a queue read in the same process. It only renders the message of a record before queueing it,
+    so later changes to its arguments don't show in the log. The listener thread does the rest of the formatting,
+    instead of the copy and full format that QueueHandler does for records sent to other processes.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setup_logger(verbose, logFile="rpmplus.log"):
     """
     Sets up the logger for the program.
+    Records are put in a queue by the logging thread and written into the log file by a listener thread, so logging never
+    waits for the disk. Any logger set up before is stopped first.
 
     Parameters
     ----------
     verbose : bool
         A boolean that determines if the logger will be verbose.
+    logFile : str, optional
+        The log filename.
     """
+    global listener
+    stop_logger()
     logger = logging.getLogger("rpmplusLogger")
     logger.setLevel(logging.DEBUG if verbose else logging.INFO)
-    logHandler = logging.FileHandler("rpmplus.log", encoding='utf-8')
+    logHandler = RotatingFileHandler(logFile, maxBytes=jt.loadConfigValue("log_max_bytes", defaultMaxBytes),
+                                     backupCount=jt.loadConfigValue("log_backup_count", defaultBackupCount), encoding='utf-8')
     logFormatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
     logHandler.setFormatter(logFormatter)
-    logger.addHandler(logHandler)
\ No newline at end of file
+    logQueue = queue.SimpleQueue()
+    listener = QueueListener(logQueue, logHandler, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(LogQueueHandler(logQueue))
+
+def stop_logger():
+    """
+    Stops the logger set up by setup_logger, writing every queued record into the log file first.
+    It's run at exit, but worker processes must call it themselves before they finish.
+    """
+    global listener
+    logger = logging.getLogger("rpmplusLogger")
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+atexit.register(stop_logger)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+logger = logging.getLogger('rpmplusLogger')
+# Stage name -> {"count": times run, "seconds": total wall time}
+spans = {}
+# (counter name, sorted label items) -> value
+counters = {}
+metricsLock = threading.Lock()
+
+@contextmanager
+def span(stage):
+    """
+    Measures the wall time of a stage. Use it as a context manager around the stage.
+
+    Parameters
+    ----------
+    stage : str
+        The stage name, e.g. "matching".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with metricsLock:
+            stats = spans.setdefault(stage, {"count": 0, "seconds": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+        logger.debug("Stage %s took %.3f s.", stage, elapsed)
+
+def increment(counter, amount=1, **labels):
+    """
+    Increments a counter.
+
+    Parameters
+    ----------
+    counter : str
+        The counter name, e.g. "api_calls".
+    amount : int, optional
+        The amount to add.
+    **labels : str
+        Labels that tell apart the values of the same counter, e.g. service="ytm".
+    """
+    key = (counter, tuple(sorted(labels.items())))
+    with metricsLock:
+        counters[key] = counters.get(key, 0) + amount
+
+def reset():
+    """
+    Clears every span and counter.
+    """
+    with metricsLock:
+        spans.clear()
+        counters.clear()
+
+def snapshot():
+    """
+    Returns the current spans and counters.
+
+    Returns
+    -------
+    dict
+        A dictionary with the "spans" by stage and the "counters" as a list of {"name", "labels", "value"} dictionaries.
+    """
+    with metricsLock:
+        return {"spans": {stage: dict(stats) for stage, stats in spans.items()},
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters.items()]}
+
+def writeAtomically(text, filename):
+    """
+    Writes a text file through a temporary file, so readers never see it half written.
+
+    Parameters
+    ----------
+    text : str
+        The content.
+    filename : str
+        The filename.
+    """
+    tempFilename = filename + ".tmp"
+    with open(tempFilename, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tempFilename, filename)
+
+def prometheusText(data):
+    """
+    Formats a metrics file in the Prometheus text exposition format, for the node exporter's textfile collector.
+
+    Parameters
+    ----------
+    data : dict
+        The metrics, as written by writeMetrics.
+
+    Returns
+    -------
+    str
+        The formatted metrics.
+    """
+    def labelText(labels):
+        if not labels:
+            return ""
+        escaped = {name: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for name, value in labels.items()}
+        return "{" + ",".join(f"{name}=\"{value}\"" for name, value in sorted(escaped.items())) + "}"
+    lines = ["# HELP rpmplus_run_success Whether the last run finished without errors.",
+             "# TYPE rpmplus_run_success gauge",
+             f"rpmplus_run_success {1 if data['success'] else 0}",
+             "# HELP rpmplus_run_timestamp_seconds When the last run finished.",
+             "# TYPE rpmplus_run_timestamp_seconds gauge",
+             f"rpmplus_run_timestamp_seconds {data['finishedAt']}",
+             "# HELP rpmplus_stage_duration_seconds Wall time spent in each stage during the last run.",
+             "# TYPE rpmplus_stage_duration_seconds gauge"]
+    for stage, stats in sorted(data["spans"].items()):
+        lines.append(f"rpmplus_stage_duration_seconds{labelText({'stage': stage})} {stats['seconds']}")
+    for name in sorted({counter["name"] for counter in data["counters"]}):
+        lines.append(f"# TYPE rpmplus_{name} gauge")
+        for counter in data["counters"]:
+            if counter["name"] == name:
+                lines.append(f"rpmplus_{name}{labelText(counter['labels'])} {counter['value']}")
+    return "\n".join(lines) + "\n"
+
+def writeMetrics(filename, prometheusFilename=None, success=True):
+    """
+    Writes the spans and counters of this run into a json file and, optionally, a Prometheus textfile.
+
+    Parameters
+    ----------
+    filename : str
+        The json metrics filename.
+    prometheusFilename : str, optional
+        The Prometheus textfile filename. It should end in .prom and be in the node exporter's textfile directory.
+    success : bool, optional
+        Whether the run finished without errors.
+    """
+    data = snapshot()
+    data["success"] = success
+    data["finishedAt"] = time.time()
+    writeAtomically(json.dumps(data, indent=2), filename)
+    if prometheusFilename:
+        writeAtomically(prometheusText(data), prometheusFilename)
+    logger.info("Metrics written into " + filename)
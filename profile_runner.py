@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import importlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import json_tools as jt
+import logging_setup
+import metrics
+logger = logging.getLogger('rpmplusLogger')
+# Files a profile can move somewhere else with its "paths" setting: key -> (module, variable, default filename).
+# Relative paths are relative to the profile directory.
+profilePaths = {
+    "config": ("json_tools", "configFile", "config.json"),
+    "auth": ("ytm_client", "authFile", "auth.json"),
+    "lastfmcreds": ("generator_engine", "lastFmCredsFile", "lastfmcreds.json"),
+    "compendium": ("compendium_store", "storeFile", "ytm_compendium.db"),
+    "compendium_json": ("compendium_engine", "jsonFile", "ytm_compendium.json"),
+    "compendium_sync": ("compendium_engine", "syncFile", "compendium_sync.json"),
+    "scrobbles": ("scrobble_store", "storeFile", "scrobbles.db"),
+}
+defaultLogFile = "rpmplus.log"
+defaultReportFile = "rpmplus_batch_report.json"
+
+def runUpdates(compendium, playlist, fullRefresh=False):
+    """
+    Updates the compendium and/or the playlist of the profile in the working directory, and writes the metrics of the run.
+    Metrics are written into "metrics_file" (rpmplus_metrics.json by default), and into "prometheus_textfile" too if it is set in config.json.
+
+    Parameters
+    ----------
+    compendium : bool
+        Whether to update the compendium.
+    playlist : bool
+        Whether to update the playlist.
+    fullRefresh : bool, optional
+        Whether to fetch every playlist again when updating the compendium, instead of only the changed ones.
+    """
+    import compendium_engine as cE
+    import generator_engine as gE
+    metrics.reset()
+    succeeded = False
+    try:
+        if compendium:
+            logger.info("Updating Compendium...")
+            with metrics.span("compendium_update"):
+                cE.loadAllPlaylists(fullRefresh)
+        if playlist:
+            logger.info("Updating Playlist...")
+            with metrics.span("playlist_update"):
+                gE.recreatePlaylist()
+        succeeded = True
+    finally:
+        metrics.writeMetrics(jt.loadConfigValue("metrics_file", "rpmplus_metrics.json"), jt.loadConfigValue("prometheus_textfile"), succeeded)
+
+def usePaths(paths):
+    """
+    Points every module to the files of a profile. Files that aren't in paths go back to their default filename.
+
+    Parameters
+    ----------
+    paths : dict
+        The "paths" setting of the profile, with keys from profilePaths.
+    """
+    unknown = set(paths) - set(profilePaths) - {"log"}
+    if unknown:
+        raise KeyError("Unknown profile paths: " + ", ".join(sorted(unknown)))
+    for key, (moduleName, variable, default) in profilePaths.items():
+        setattr(importlib.import_module(moduleName), variable, paths.get(key, default))
+    # Clients and users connected for another profile must not be reused.
+    importlib.import_module("ytm_client").resetClient()
+    importlib.import_module("generator_engine").lastFmUser = None
+
+def runProfile(profile, compendium, playlist, verbose, fullRefresh=False):
+    """
+    Runs the updates of a single profile inside its own directory. It's run in a worker process of runBatch.
+    The profile logs into its own rpmplus.log, and any error is caught and reported in the summary instead of raised.
+
+    Parameters
+    ----------
+    profile : dict
+        The profile, with its "name", its absolute "directory" and optionally its "paths" and "jobs".
+    compendium : bool
+        Whether to update the compendium, unless the profile has its own "jobs".
+    playlist : bool
+        Whether to update the playlist, unless the profile has its own "jobs".
+    verbose : bool
+        Whether to enable verbose logging.
+    fullRefresh : bool, optional
+        Whether to fetch every playlist again when updating the compendium.
+
+    Returns
+    -------
+    dict
+        The summary of the run: name, directory, jobs, succeeded, error, seconds, and the spans and counters of metrics.
+    """
+    start = time.perf_counter()
+    jobs = profile.get("jobs", [job for job, enabled in (("compendium", compendium), ("playlist", playlist)) if enabled])
+    summary = {"name": profile["name"], "directory": profile["directory"], "jobs": jobs, "succeeded": False, "error": None}
+    # Handlers inherited from the parent process would log into the wrong file.
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    metrics.reset()
+    try:
+        os.chdir(profile["directory"])
+        paths = profile.get("paths", {})
+        # The profile's paths go first, so the logger reads the rotation settings from its config.json.
+        usePaths(paths)
+        logging_setup.setup_logger(verbose, paths.get("log", defaultLogFile))
+        logger.info("Running profile %s (%s).", profile["name"], ", ".join(jobs))
+        runUpdates("compendium" in jobs, "playlist" in jobs, fullRefresh)
+        summary["succeeded"] = True
+    except Exception as e:
+        logger.exception("Profile %s failed.", profile["name"])
+        summary["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        # Worker processes don't run atexit, so the queued records are written here.
+        logging_setup.stop_logger()
+    summary["seconds"] = time.perf_counter() - start
+    summary.update(metrics.snapshot())
+    return summary
+
+def loadProfiles(profilesFile):
+    """
+    Loads a profiles file. It's a json file like {"workers": 2, "profiles": [{"name": "alice", "directory": "alice"}, ...]}.
+    Every profile needs a "name" and a "directory" with its own config.json, auth.json and lastfmcreds.json.
+    Optionally, it can have "paths" to put some of its files elsewhere (see profilePaths, plus "log"), and "jobs" to only run
+    some of ["compendium", "playlist"].
+
+    Parameters
+    ----------
+    profilesFile : str
+        The profiles filename.
+
+    Returns
+    -------
+    tuple
+        The profiles, with their directories made absolute (relative ones are relative to the profiles file),
+        and the "workers" setting of the file (None if it isn't set).
+    """
+    data = jt.loadJson(profilesFile)
+    if not data or not data.get("profiles"):
+        raise ValueError(profilesFile + " has no profiles.")
+    baseDirectory = os.path.dirname(os.path.abspath(profilesFile))
+    profiles = []
+    for profile in data["profiles"]:
+        if "name" not in profile or "directory" not in profile:
+            raise ValueError("Every profile in " + profilesFile + " needs a name and a directory.")
+        profiles.append(dict(profile, directory=os.path.join(baseDirectory, profile["directory"])))
+    names = [profile["name"] for profile in profiles]
+    if len(set(names)) != len(names):
+        raise ValueError("Profile names in " + profilesFile + " must be unique.")
+    return profiles, data.get("workers")
+
+def runBatch(profilesFile, compendium, playlist, verbose, workers=None, reportFile=defaultReportFile, fullRefresh=False):
+    """
+    Runs the updates of every profile in a profiles file in parallel, in a pool of worker processes, and writes a report
+    with the summary of each profile.
+
+    Parameters
+    ----------
+    profilesFile : str
+        The profiles filename. See loadProfiles for its format.
+    compendium : bool
+        Whether to update the compendium of profiles without their own "jobs".
+    playlist : bool
+        Whether to update the playlist of profiles without their own "jobs".
+    verbose : bool
+        Whether to enable verbose logging in the profiles.
+    workers : int, optional
+        The amount of worker processes. By default, the "workers" setting of the profiles file, or one per profile up to the CPU count.
+    reportFile : str, optional
+        The report filename.
+    fullRefresh : bool, optional
+        Whether to fetch every playlist again when updating the compendiums.
+
+    Returns
+    -------
+    list
+        The summaries of every profile, in the order of the profiles file.
+    """
+    profiles, fileWorkers = loadProfiles(profilesFile)
+    workers = workers or fileWorkers or min(len(profiles), os.cpu_count() or 1)
+    logger.info(f"Running {len(profiles)} profiles with {workers} workers...")
+    startedAt = time.time()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runProfile, profile, compendium, playlist, verbose, fullRefresh) for profile in profiles]
+        for profile, future in zip(profiles, futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                # Only happens if the worker process itself died.
+                logger.exception(f"Worker of profile {profile['name']} crashed.")
+                summaries.append({"name": profile["name"], "directory": profile["directory"], "succeeded": False,
+                                  "error": f"{type(e).__name__}: {e}"})
+    for summary in summaries:
+        if summary["succeeded"]:
+            logger.info(f"Profile {summary['name']}: succeeded in {summary['seconds']:.1f} s.")
+        else:
+            logger.error(f"Profile {summary['name']}: failed. {summary['error']}")
+    jt.writeIntoJson({"startedAt": startedAt, "finishedAt": time.time(), "workers": workers, "profiles": summaries}, reportFile)
+    return summaries
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+import sqlite3
+import logging
+import itertools
+import lastfm_client
+import metrics
+from contextlib import closing
+logger = logging.getLogger('rpmplusLogger')
+storeFile = "scrobbles.db"
+# Scrobbles are rolled up into UTC days.
+daySeconds = 24 * 60 * 60
+
+def openStore():
+    """
+    Opens the local scrobble store, creating it if it doesn't exist.
+    Played tracks are kept as daily rollups: the plays, last play and longest run (uninterrupted loop) of every title
+    on every day, plus the runs at both edges of each day, so loops that go past midnight are joined again when days are merged.
+    Raw scrobbles are only kept from the start of the newest day, which is the only one that can still get new scrobbles.
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection to scrobbles.db.
+    """
+    conn = sqlite3.connect(storeFile)
+    conn.execute("""CREATE TABLE IF NOT EXISTS scrobbles (
+                        timestamp INTEGER NOT NULL,
+                        title TEXT NOT NULL,
+                        artist TEXT NOT NULL,
+                        album TEXT,
+                        playbackDate TEXT,
+                        PRIMARY KEY (timestamp, title, artist))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS dailyPlays (
+                        day INTEGER NOT NULL,
+                        title TEXT NOT NULL,
+                        plays INTEGER NOT NULL,
+                        lastPlayed INTEGER NOT NULL,
+                        longestRun INTEGER NOT NULL,
+                        PRIMARY KEY (day, title))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS dayEdges (
+                        day INTEGER PRIMARY KEY,
+                        plays INTEGER NOT NULL,
+                        newestTitle TEXT NOT NULL,
+                        newestRun INTEGER NOT NULL,
+                        oldestTitle TEXT NOT NULL,
+                        oldestRun INTEGER NOT NULL)""")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+def dayOf(timestamp):
+    """
+    Finds the UTC day of a unix timestamp.
+
+    Parameters
+    ----------
+    timestamp : int
+        The unix timestamp.
+
+    Returns
+    -------
+    int
+        The amount of days since the epoch.
+    """
+    return int(timestamp) // daySeconds
+
+def newestTimestamp(conn):
+    """
+    Finds the newest scrobble already synced into the store.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+
+    Returns
+    -------
+    int or None
+        The unix timestamp of the newest stored scrobble. None if the store is empty.
+    """
+    return conn.execute("SELECT MAX(timestamp) FROM scrobbles").fetchone()[0]
+
+def loadCoveredSince(conn):
+    """
+    Finds the time from which the store has every scrobble.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+
+    Returns
+    -------
+    int or None
+        The unix timestamp. None if nothing was synced yet.
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'coveredSince'").fetchone()
+    return None if row is None else int(row[0])
+
+def addScrobbles(conn, playedTracks):
+    """
+    Adds scrobbles to the store, ignoring the ones that are already stored.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+    playedTracks : list
+        A list of PlayedTrack objects, as returned by pylast.
+
+    Returns
+    -------
+    int
+        The amount of new scrobbles stored.
+    """
+    before = conn.total_changes
+    conn.executemany("INSERT OR IGNORE INTO scrobbles VALUES (?, ?, ?, ?, ?)",
+                     ((int(track.timestamp), track.track.get_title(), track.track.get_artist().get_name(), track.album, track.playback_date)
+                      for track in playedTracks))
+    return conn.total_changes - before
+
+def runLength(titles):
+    """
+    Counts how many times the first title of a sequence is repeated at its start.
+
+    Parameters
+    ----------
+    titles : list
+        The titles.
+
+    Returns
+    -------
+    int
+        The length of the first run.
+    """
+    length = 1
+    while length < len(titles) and titles[length] == titles[0]:
+        length += 1
+    return length
+
+def rollUpDay(scrobbles):
+    """
+    Rolls up the scrobbles of a single day.
+
+    Parameters
+    ----------
+    scrobbles : list
+        The (timestamp, title) pairs of the day, newest first.
+
+    Returns
+    -------
+    tuple
+        The rollup of every title, {title: [plays, lastPlayed, longestRun]}, and the edges of the day,
+        (plays, newestTitle, newestRun, oldestTitle, oldestRun).
+    """
+    dayPlays = {}
+    previousTitle = None
+    count = 0
+    for timestamp, title in scrobbles:
+        plays = dayPlays.get(title)
+        if plays is None:
+            plays = dayPlays[title] = [0, timestamp, 0]
+        plays[0] += 1
+        count = count + 1 if title == previousTitle else 1
+        if plays[2] < count:
+            plays[2] = count
+        previousTitle = title
+    titles = [title for _, title in scrobbles]
+    edges = (len(titles), titles[0], runLength(titles), titles[-1], runLength(titles[::-1]))
+    return dayPlays, edges
+
+def rollUpDays(conn, fromDay):
+    """
+    Rebuilds the daily rollups of every day from a given one onwards, from the raw scrobbles of those days.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+    fromDay : int
+        The first day to rebuild, as returned by dayOf.
+
+    Returns
+    -------
+    int
+        The amount of days rolled up.
+    """
+    conn.execute("DELETE FROM dailyPlays WHERE day >= ?", (fromDay,))
+    conn.execute("DELETE FROM dayEdges WHERE day >= ?", (fromDay,))
+    # Newest first, in the same order as pylast returns them, so runs are counted like generator_engine.buildScrobbleStats does.
+    rows = conn.execute("SELECT timestamp, title FROM scrobbles WHERE timestamp >= ? ORDER BY timestamp DESC, rowid ASC",
+                        (fromDay * daySeconds,))
+    days = 0
+    for day, scrobbles in itertools.groupby(rows, key=lambda row: dayOf(row[0])):
+        dayPlays, edges = rollUpDay(list(scrobbles))
+        conn.executemany("INSERT INTO dailyPlays VALUES (?, ?, ?, ?, ?)",
+                         ((day, title, plays, lastPlayed, longestRun) for title, (plays, lastPlayed, longestRun) in dayPlays.items()))
+        conn.execute("INSERT INTO dayEdges VALUES (?, ?, ?, ?, ?, ?)", (day,) + edges)
+        days += 1
+    return days
+
+def loadScrobbleStats(conn, sinceDay):
+    """
+    Merges the daily rollups from a given day onwards into the scrobble statistics of every title, in a single pass over the days.
+    It gives the same statistics as generator_engine.buildScrobbleStats over the scrobbles of those days.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection returned by openStore.
+    sinceDay : int
+        The first day of the window, as returned by dayOf.
+
+    Returns
+    -------
+    dict
+        A dictionary with titles as keys. Each value is a dictionary with the "lastPlayed" unix timestamp,
+        the "maxRepetitions" (longest uninterrupted loop) and the "playCount" of the title.
+    """
+    scrobbleStats = {title: {"lastPlayed": lastPlayed, "maxRepetitions": longestRun, "playCount": plays}
+                     for title, plays, lastPlayed, longestRun in conn.execute(
+                         """SELECT title, SUM(plays), MAX(lastPlayed), MAX(longestRun) FROM dailyPlays
+                            WHERE day >= ? GROUP BY title""", (sinceDay,))}
+    # Runs that go past midnight. runTitle and runCount are the run at the oldest edge of the days merged so far, newest first.
+    runTitle = None
+    runCount = 0
+    for plays, newestTitle, newestRun, oldestTitle, oldestRun in conn.execute(
+            "SELECT plays, newestTitle, newestRun, oldestTitle, oldestRun FROM dayEdges WHERE day >= ? ORDER BY day DESC", (sinceDay,)):
+        if newestTitle == runTitle:
+            joined = runCount + newestRun
+            stats = scrobbleStats[runTitle]
+            stats["maxRepetitions"] = max(stats["maxRepetitions"], joined)
+            # A day with a single run doesn't end the run, it makes it longer.
+            runCount = joined if newestRun == plays else oldestRun
+        else:
+            runCount = oldestRun
+        runTitle = oldestTitle
+    return scrobbleStats
+
+def syncScrobbleStats(userSelf, since):
+    """
+    Syncs the scrobbles that are newer than the newest stored one from last.fm, rolls them up into their days, and answers
+    the statistics of the window from the rollups. The window is made of whole days, from the day of since onwards.
+    Only if since is older than anything synced before (like after making the window longer), every scrobble since then is downloaded.
+    Rollups older than the window are dropped from the store.
+
+    Parameters
+    ----------
+    userSelf : pylast.User
+        The userSelf object that generator_engine.lastFmNetworkConnect() returns.
+    since : int
+        The unix timestamp of the start of the window.
+
+    Returns
+    -------
+    dict
+        The scrobble statistics of every title in the window, like generator_engine.buildScrobbleStats returns them.
+    """
+    sinceDay = dayOf(since)
+    windowStart = sinceDay * daySeconds
+    with closing(openStore()) as conn:
+        with conn:
+            newest = newestTimestamp(conn)
+            coveredSince = loadCoveredSince(conn)
+            if newest is None or coveredSince is None or windowStart < coveredSince:
+                timeFrom = windowStart
+                coveredSince = windowStart
+            else:
+                timeFrom = max(windowStart, newest)
+            logger.info(f"Syncing scrobbles from Last.FM since {timeFrom}...")
+            playedTracks = lastfm_client.fetchRecentTracks(userSelf, timeFrom)
+            metrics.increment("scrobbles_fetched", len(playedTracks))
+            added = addScrobbles(conn, playedTracks)
+            # Only the days of the new scrobbles change, and the raw scrobbles of those days are all in the store.
+            days = rollUpDays(conn, dayOf(timeFrom))
+            metrics.increment("days_rolled_up", days)
+            newest = newestTimestamp(conn)
+            if newest is not None:
+                conn.execute("DELETE FROM scrobbles WHERE timestamp < ?", (dayOf(newest) * daySeconds,))
+            conn.execute("DELETE FROM dailyPlays WHERE day < ?", (sinceDay,))
+            conn.execute("DELETE FROM dayEdges WHERE day < ?", (sinceDay,))
+            # Days before the window are gone now, so the store doesn't cover them anymore.
+            coveredSince = max(coveredSince, windowStart)
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('coveredSince', ?)", (str(coveredSince),))
+        logger.info(f"Synced {added} new scrobbles.")
+        return loadScrobbleStats(conn, sinceDay)
@@ -7,19 +7,8 @@ version = "1.6.3"
 # PACKAGE CHECKER
 import subprocess
 import sys
-import pkg_resources
-def checkDependencies(requirements_file):
-    with open(requirements_file, 'r') as file:
-        requirements = pkg_resources.parse_requirements(file)
-        for requirement in requirements:
-            try:
-                pkg_resources.require(str(requirement))
-            except pkg_resources.DistributionNotFound:
-                return False  # A dependency is missing
-            except pkg_resources.VersionConflict:
-                return False  # Version conflict exists
-    return True
-if not checkDependencies("requirements.txt"):
+import dependency_check
+if not dependency_check.checkDependencies("requirements.txt"):
     print("Some dependencies are missing. Installing them now.")
     subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
 # IMPORTS
@@ -183,8 +172,7 @@ def initialSetup():
     print("Note that it will need to be updated from time to time as you find new tracks and either put them in playlists (including liked songs) or listen to them.")
     print("If a compendium was already present, it will be updated.")
     logger.info("Compendium creation process started.")
-    logger.info("Attempting to create ytm_compendium.json...")
-    jt.createJson("ytm_compendium.json")
+    logger.info("Creating the compendium store (ytm_compendium.db)...")
     print("Creating Compendium...")
     cE.loadAllPlaylists()
     print("Done.")
@@ -213,7 +201,7 @@ def ytmIsAuthenticate():
     Authenticates YTM in the initial setup. It prompts the user to choose between oauth and browser authentication, then guides them through the process.
     """
     import ytmusicapi
-    from ytmusicapi import YTMusic
+    import ytm_client as ytm
     def authVerified(first):
         if first:
             return False
@@ -222,9 +210,9 @@ def ytmIsAuthenticate():
             print("Something went wrong- The auth didn't save. Let's try again.")
             return False
         else:
-            yt = YTMusic("auth.json")
+            ytm.resetClient()
             try:
-                yt.get_account_info()
+                ytm.getClient().get_account_info()
                 return True
             except Exception as e:
                 logger.error("YTM authentication failed.")
@@ -317,6 +305,7 @@ def update():
             print("2 - Compendium Only")
             print("3 - Compendium and ReplayMix+")
             print("4 - Return to Main Menu")
+            print("5 - Full Compendium Refresh (fetches every playlist again)")
             print("")
         print("Enter a number then press enter.")
         ansUpdt  = input("")
@@ -357,6 +346,16 @@ def update():
             repMenu = True
         elif ansUpdt == "4":
             return
+        elif ansUpdt == "5":
+            logger.info("Executing full refresh of the compendium.")
+            logger.info("Beginning compendium update...")
+            print("Updating Compendium...")
+            cE.loadAllPlaylists(True)
+            logger.info("Compendium update complete.")
+            print("Done.")
+            print("--------")
+            print("")
+            repMenu = True
         else:
             print("Invalid input.")
             repMenu = False
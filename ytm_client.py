@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Replay Mix+ by soreikomori
+https://github.com/soreikomori/ReplayMixPlus
+"""
+from ytmusicapi import YTMusic
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import logging
+import json_tools as jt
+logger = logging.getLogger('rpmplusLogger')
+authFile = "auth.json"
+client = None
+clientLock = threading.Lock()
+
+def createSession():
+    """
+    Creates the HTTP session shared by every YTM request. Connections are kept alive and pooled,
+    with room for as many parallel requests as the "playlist_fetch_workers" setting in config.json allows.
+
+    Returns
+    -------
+    requests.Session
+        The pooled session.
+    """
+    poolSize = max(1, jt.loadConfigValue("playlist_fetch_workers", 4))
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=poolSize))
+    return session
+
+def getClient():
+    """
+    Returns the YTMusic client shared by the whole program. It's only created the first time it's needed.
+
+    Returns
+    -------
+    YTMusic
+        The authenticated ytmusicapi client.
+    """
+    global client
+    if client is None:
+        with clientLock:
+            if client is None:
+                logger.info("Creating YTM client.")
+                client = YTMusic(authFile, requests_session=createSession())
+    return client
+
+def resetClient():
+    """
+    Drops the shared YTMusic client, so that the next getClient call creates a new one. Used after authenticating again.
+    """
+    global client
+    with clientLock:
+        client = None